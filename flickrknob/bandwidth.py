@@ -0,0 +1,177 @@
+"""
+
+Bandwidth shaping for uploads.
+
+All the upload workers draw from single token bucket as they read the data
+of the files being uploaded. The bucket hands out the bytes in the order
+the reads were requested so that the files being uploaded concurrently
+get fair share of the bandwidth.
+
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+RATE_SUFFIXES = {"k": 1024, "m": 1024**2, "g": 1024**3}
+
+# How often (in seconds) to reevaluate the rate schedule.
+SCHEDULE_CHECK_INTERVAL = 60
+
+
+def parse_rate(value):
+    """
+    Parse rate in bytes per second with optional K/M/G suffix (powers of 1024),
+    e.g. "512K" or "2M". Zero means unlimited.
+    :return: rate as integer or None for unlimited
+    """
+    value = value.strip()
+    multiplier = 1
+    if value and value[-1].lower() in RATE_SUFFIXES:
+        multiplier = RATE_SUFFIXES[value[-1].lower()]
+        value = value[:-1]
+
+    rate = int(float(value) * multiplier)
+    if rate < 0:
+        raise ValueError(f"negative rate: {value}")
+    if rate == 0:
+        return None
+
+    return rate
+
+
+def parse_schedule(value):
+    """
+    Parse time of day schedule of rates in the form of comma separated
+    HH:MM-HH:MM=RATE entries, e.g. "08:00-18:00=1M,18:00-22:00=4M".
+    The interval can span midnight.
+    :return: list of (start, end, rate) tuples with start/end as datetime.time
+    """
+    schedule = []
+    for entry in value.split(","):
+        interval, rate = entry.split("=")
+        start, end = interval.split("-")
+        schedule.append(
+            (
+                datetime.strptime(start.strip(), "%H:%M").time(),
+                datetime.strptime(end.strip(), "%H:%M").time(),
+                parse_rate(rate),
+            )
+        )
+
+    return schedule
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket limiting the number of bytes per second.
+
+    Instead of keeping count of tokens, the bucket keeps track of the time
+    when the bytes handed out so far will have been paid for. Each consumer
+    reserves its bytes by moving this time forward and then sleeps until
+    its reservation is due, so the waiting happens outside of the lock
+    and in the order of the reservations.
+    """
+
+    def __init__(self, rate=None, schedule=None, burst=1.0):
+        """
+        :param rate: bytes per second or None for unlimited; used outside
+        of the scheduled intervals
+        :param schedule: list of (start, end, rate) tuples
+        :param burst: number of seconds worth of data that can be sent
+        at once after the bucket was idle
+        """
+        self.default_rate = rate
+        self.schedule = schedule or []
+        self.burst = burst
+        self.rate = rate
+        self.rate_checked = 0
+        self.due = 0
+        self.lock = threading.Lock()
+
+    def is_limited(self):
+        """
+        return whether the bucket might ever limit the bandwidth
+        """
+        return self.default_rate is not None or any(
+            rate is not None for _, _, rate in self.schedule
+        )
+
+    def get_rate(self):
+        """
+        return current rate according to the schedule
+        """
+        if not self.schedule:
+            return self.default_rate
+
+        now = time.monotonic()
+        if now - self.rate_checked < SCHEDULE_CHECK_INTERVAL:
+            return self.rate
+
+        self.rate_checked = now
+        self.rate = self.default_rate
+        time_of_day = datetime.now().time()
+        for start, end, rate in self.schedule:
+            if start <= end:
+                matches = start <= time_of_day < end
+            else:
+                matches = time_of_day >= start or time_of_day < end
+            if matches:
+                self.rate = rate
+                break
+
+        return self.rate
+
+    def consume(self, nbytes):
+        """
+        Wait until given number of bytes can be sent.
+        """
+        rate = self.get_rate()
+        if rate is None:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            # After idle period the bucket is full, i.e. up to burst
+            # worth of bytes can be sent immediately.
+            self.due = max(self.due, now - self.burst) + nbytes / rate
+            delay = self.due - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_bucket(rate, schedule):
+    """
+    return token bucket for given rate and schedule or None if the bandwidth
+    is not limited at all so that the uploads do not incur any overhead
+    """
+    bucket = TokenBucket(rate, schedule)
+    if not bucket.is_limited():
+        return None
+
+    return bucket
+
+
+# pylint: disable=R0903
+class ThrottledFile:
+    """
+    File object wrapper that draws from token bucket for all the data read.
+    Has the attributes needed for file object passed to FlickrAPI.upload().
+    """
+
+    def __init__(self, file_obj, bucket):
+        self.file_obj = file_obj
+        self.bucket = bucket
+        self.len = os.fstat(file_obj.fileno()).st_size
+        self.fileno = file_obj.fileno
+        self.tell = file_obj.tell
+
+    def read(self, size=-1):
+        """
+        read data from the file, waiting for the bucket as necessary
+        """
+        data = self.file_obj.read(size)
+        self.bucket.consume(len(data))
+        return data
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from flickrknob.download_album import download_album
+
+
+if __name__ == "__main__":
+    download_album()
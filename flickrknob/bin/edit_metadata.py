@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from flickrknob.edit_metadata import edit_metadata
+
+
+if __name__ == "__main__":
+    edit_metadata()
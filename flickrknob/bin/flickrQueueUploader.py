@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from flickrknob.queue_uploader import queue_uploader
+
+
+if __name__ == "__main__":
+    queue_uploader()
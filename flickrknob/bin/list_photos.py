@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from flickrknob.list_album import list_album_photos
+from flickrknob.list_photos import list_album_photos
 
 
 if __name__ == "__main__":
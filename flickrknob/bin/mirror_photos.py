@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from flickrknob.mirror_photos import mirror_photos
+
+
+if __name__ == "__main__":
+    mirror_photos()
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from flickrknob.sort_album import sort_albums
+
+
+if __name__ == "__main__":
+    sort_albums()
@@ -10,6 +10,7 @@ however sometimes the upload process fails and it is easier to start from scratc
 """
 
 import argparse
+import logging
 import sys
 
 from alive_progress import alive_bar
@@ -17,7 +18,14 @@ from decouple import config
 
 import flickrapi
 
-from .flickrknob import auth_check, delete_album, delete_photo, get_album_id
+from .flickrknob import (
+    auth_check,
+    delete_album,
+    delete_photo,
+    get_album_id,
+    get_album_photos,
+    log_remaining_calls,
+)
 from .logutil import get_package_logger
 from .parserutil import get_base_parser
 from .utils import check_env, confirm, parse_args
@@ -47,23 +55,23 @@ def delete_album_with_photos():
     flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
     auth_check(flickr, perms="delete")
 
+    # The album is always looked up on Flickr rather than in the local mirror
+    # which might refer to album that was renamed since.
     album_id = get_album_id(flickr, args.name)
     if album_id is None:
         sys.exit(1)
 
     # Get list of photos in the album. (so that progress can be displayed)
     logger.info("Getting photo IDs")
-    res = flickr.photosets.getPhotos(photoset_id=album_id)
-    photoset_elem = res.find("photoset")
-    logger.debug(f"photoset elem: {photoset_elem}")
-    photo_ids = []
-    for photo_elem in list(photoset_elem.iter("photo")):
-        photo_id = photo_elem.attrib["id"]
-        if photo_id:
-            photo_ids.append(photo_id)
-    logger.debug(f"Photo IDs: {photo_ids}")
-
-    if not confirm(f"Delete album with {len(photo_ids)} photos ? Y/N "):
+    photo_ids = [
+        photo["id"] for photo in get_album_photos(flickr, album_id) if photo.get("id")
+    ]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Photo IDs: {photo_ids}")
+
+    if not confirm(
+        f"Delete album '{args.name}' ({album_id}) with {len(photo_ids)} photos ? Y/N "
+    ):
         sys.exit(0)
 
     logger.info(f"Deleting {len(photo_ids)} files")
@@ -81,3 +89,5 @@ def delete_album_with_photos():
     album_id = get_album_id(flickr, args.name)
     if album_id is not None:
         delete_album(flickr, album_id)
+
+    log_remaining_calls(flickr)
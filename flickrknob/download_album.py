@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+"""
+
+This program downloads original photos of given album into a directory,
+e.g. for backup before deleting the album.
+
+The files are named according to the titles of the photos (i.e. the original
+file names if the photos were uploaded with the uploader). Partially downloaded
+files are resumed and files that were already downloaded are skipped,
+so the download can be simply restarted.
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from alive_progress import alive_bar
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+import flickrapi
+
+from .flickrknob import (
+    auth_check,
+    get_album_id,
+    get_album_photos,
+    log_remaining_calls,
+)
+from .logutil import get_package_logger
+from .parserutil import get_base_parser, get_cache_parser
+from .utils import check_env, parse_args, run_windowed
+
+flickrKey = config("FLICKR_KEY")
+flickrSecret = config("FLICKR_SECRET")
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+
+DOWNLOADED = "downloaded"
+SKIPPED = "skipped"
+
+
+def get_args():
+    """
+    return parsed arguments from command line
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        description="download original photos of Flickr album",
+        parents=[get_base_parser(), get_cache_parser()],
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries when single file download fails",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=8
+    )
+    parser.add_argument("name", help="album name")
+    parser.add_argument("directory", help="directory to store the files in")
+
+    return parse_args(parser)
+
+
+def get_session(numworkers):
+    """
+    return HTTP session with connection pool large enough for all the workers
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=numworkers, pool_maxsize=numworkers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def download_file(session, url, file_path, chunk_size=CHUNK_SIZE):
+    """
+    Download the URL to the file, streaming the data in chunks.
+
+    The data is downloaded to temporary file with .part suffix first.
+    If such file exists, the download is resumed using HTTP Range request.
+    If the file already exists with the expected size, it is not downloaded.
+
+    Throws requests.RequestException or OSError on error.
+    :return: DOWNLOADED or SKIPPED
+    """
+    logger = logging.getLogger(__name__)
+
+    res = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    res.raise_for_status()
+    length = res.headers.get("Content-Length")
+    length = int(length) if length is not None else None
+
+    if length is not None and os.path.isfile(file_path):
+        if os.path.getsize(file_path) == length:
+            logger.debug(f"File '{file_path}' already downloaded")
+            return SKIPPED
+
+    part_path = file_path + ".part"
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if length is not None and offset > length:
+        offset = 0
+
+    headers = {}
+    if offset > 0:
+        logger.debug(f"Resuming download of '{file_path}' from offset {offset}")
+        headers["Range"] = f"bytes={offset}-"
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as res:
+        if res.status_code == 416 and offset == length:
+            # The partial file is in fact complete.
+            pass
+        else:
+            res.raise_for_status()
+            # The server might not support ranges and send the whole file.
+            mode = "ab" if res.status_code == 206 else "wb"
+            with open(part_path, mode) as file_obj:
+                for chunk in res.iter_content(chunk_size=chunk_size):
+                    file_obj.write(chunk)
+
+    if length is not None and os.path.getsize(part_path) != length:
+        raise requests.RequestException(
+            f"size of '{part_path}' does not match the expected size {length}"
+        )
+
+    os.replace(part_path, file_path)
+    return DOWNLOADED
+
+
+def get_file_names(photos):
+    """
+    Generate (photo, file name) tuples for the photos. The file names are based
+    on the photo titles, with the original format as suffix if the title
+    does not have any. Duplicate file names get the photo ID appended.
+    """
+    used = set()
+    for photo in photos:
+        file_name = (photo.get("title") or photo["id"]).replace(os.sep, "_")
+        base, suffix = os.path.splitext(file_name)
+        if not suffix and photo.get("originalformat"):
+            suffix = "." + photo["originalformat"]
+        file_name = base + suffix
+        if file_name in used:
+            file_name = f"{base}-{photo['id']}{suffix}"
+        used.add(file_name)
+
+        yield photo, file_name
+
+
+# pylint: disable=R0913
+def download_photo(session, photo, file_path, retries, progress_bar):
+    """
+    worker function to download single photo and report progress
+    """
+    logger = logging.getLogger(__name__)
+
+    for i in range(1, retries + 2):
+        try:
+            ret = download_file(session, photo["url_o"], file_path)
+            break
+        except (requests.RequestException, OSError) as exc:
+            logger.debug(
+                f"Failed to download '{file_path}' (try {i}/{retries + 1}): {exc}"
+            )
+            if i == retries + 1:
+                raise exc
+
+    progress_bar()
+    return ret
+
+
+def get_downloads(photos, directory):
+    """
+    Generate (photo, file path) tuples for the photos that can be downloaded.
+    """
+    logger = logging.getLogger(__name__)
+
+    for photo, file_name in get_file_names(photos):
+        if photo.get("media") == "video":
+            # The original URL of video points to still image.
+            logger.warning(f"Skipping video '{file_name}'")
+            continue
+        if not photo.get("url_o"):
+            logger.warning(f"No original URL for '{file_name}'")
+            continue
+
+        yield photo, os.path.join(directory, file_name)
+
+
+def download_album():
+    """
+    command line tool to download photos of an album
+    """
+    args = get_args()
+
+    logger = get_package_logger(args.loglevel)
+
+    check_env(flickrKey, flickrSecret)
+
+    logger.info("Checking authentication")
+    flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
+    auth_check(flickr)
+
+    album_id = get_album_id(
+        flickr, args.name, mirror_path=args.db if args.cached else None
+    )
+    if album_id is None:
+        sys.exit(1)
+
+    os.makedirs(args.directory, exist_ok=True)
+
+    session = get_session(args.threads)
+    photos = get_album_photos(
+        flickr, album_id, extras=["url_o", "original_format", "media"]
+    )
+    counts = {DOWNLOADED: 0, SKIPPED: 0}
+    failed = 0
+    logger.info(f"Downloading photos of album '{args.name}' to '{args.directory}'")
+    with alive_bar() as progress_bar:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            tasks = run_windowed(
+                executor,
+                download_photo,
+                (
+                    (session, photo, file_path, args.retries, progress_bar)
+                    for photo, file_path in get_downloads(photos, args.directory)
+                ),
+                args.threads,
+            )
+            for (_, _, file_path, _, _), future in tasks:
+                try:
+                    counts[future.result()] += 1
+                except (requests.RequestException, OSError) as exc:
+                    logger.error(f"Failed to download '{file_path}': {exc}")
+                    failed = failed + 1
+
+    logger.info(
+        f"Downloaded {counts[DOWNLOADED]} files, "
+        f"skipped {counts[SKIPPED]} already downloaded files"
+    )
+
+    log_remaining_calls(flickr)
+
+    if failed > 0:
+        logger.error(f"Failed to download {failed} files")
+        sys.exit(1)
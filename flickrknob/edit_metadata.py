@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+"""
+
+This program edits title, description and tags of photos in given album.
+
+The edits are read from CSV or JSON file keyed by file name (i.e. the title
+of the photo as set by the uploader) or photo ID. Only the values that differ
+from the current ones are changed.
+
+"""
+
+import argparse
+import csv
+import json
+import logging
+import re
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from alive_progress import alive_bar
+from decouple import config
+
+import flickrapi
+
+from .flickrknob import (
+    auth_check,
+    get_album_id,
+    get_album_photos,
+    log_remaining_calls,
+    set_photo_meta,
+    set_photo_tags,
+)
+from .logutil import get_package_logger
+from .parserutil import get_base_parser, get_cache_parser
+from .utils import check_env, parse_args, run_windowed
+
+flickrKey = config("FLICKR_KEY")
+flickrSecret = config("FLICKR_SECRET")
+
+FIELDS = ["title", "description", "tags"]
+
+
+def get_args():
+    """
+    return parsed arguments from command line
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        description="edit title, description and tags of photos in Flickr album",
+        parents=[get_base_parser(), get_cache_parser()],
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="only print the changes that would be made",
+    )
+    parser.add_argument(
+        "--retries",
+        help="Number of retries when editing single photo fails",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+    parser.add_argument("name", help="album name")
+    parser.add_argument(
+        "mapping",
+        help="CSV or JSON file with the edits. CSV has 'file' or 'id' column "
+        "and any of 'title', 'description', 'tags' columns. JSON is either "
+        "list of such objects or object mapping file names/IDs to the edits.",
+    )
+
+    return parse_args(parser)
+
+
+def load_json_rows(path):
+    """
+    Load the entries of the mapping from JSON file.
+    Throws ValueError if the file does not have the expected structure.
+    :return: list of dictionaries
+    """
+    with open(path, encoding="utf-8") as mapping_file:
+        data = json.load(mapping_file)
+
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        raise ValueError(f"expected object or list, got: {data}")
+
+    rows = []
+    for key, edits in data.items():
+        if not isinstance(edits, dict):
+            raise ValueError(f"edits for '{key}' are not an object: {edits}")
+        rows.append(dict(edits, file=key))
+
+    return rows
+
+
+def load_mapping(path):
+    """
+    Load the edits from CSV or JSON file.
+    Throws ValueError if the file does not have the expected structure.
+    :return: list of (key, edits) tuples where key is file name or photo ID
+    and edits is dictionary with the new values
+    """
+    if path.lower().endswith(".json"):
+        rows = load_json_rows(path)
+    else:
+        with open(path, encoding="utf-8", newline="") as mapping_file:
+            rows = list(csv.DictReader(mapping_file))
+
+    ret = []
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"entry is not an object: {row}")
+        key = row.get("id") or row.get("file")
+        if not key:
+            raise ValueError(f"entry without 'file' or 'id': {row}")
+        # JSON might have the IDs as numbers.
+        key = str(key)
+        # Empty CSV cells mean the value should be left alone.
+        edits = {
+            field: row[field]
+            for field in FIELDS
+            if field in row and row[field] is not None and row[field] != ""
+        }
+        if isinstance(edits.get("tags"), list):
+            edits["tags"] = " ".join(f'"{tag}"' for tag in edits["tags"])
+        for field, value in edits.items():
+            if not isinstance(value, str):
+                raise ValueError(f"{field} of '{key}' is not a string: {value}")
+        ret.append((key, edits))
+
+    return ret
+
+
+def normalize_tags(tags):
+    """
+    return set of tags normalized the way Flickr does it for the tags extra
+    """
+    try:
+        tag_list = shlex.split(tags or "")
+    except ValueError:
+        tag_list = (tags or "").split()
+
+    return {re.sub(r"[^\w:=]", "", tag.lower()) for tag in tag_list}
+
+
+def get_changes(photo, edits):
+    """
+    return dictionary mapping field names to (old, new) tuples
+    for the values that differ from the current values of the photo
+    """
+    changes = {}
+    for field, new_value in edits.items():
+        old_value = photo.get(field) or ""
+        if field == "tags":
+            if normalize_tags(old_value) == normalize_tags(new_value):
+                continue
+        elif old_value == new_value:
+            continue
+        changes[field] = (old_value, new_value)
+
+    return changes
+
+
+def is_same_value(field, value, other_value):
+    """
+    return whether the values of the field are the same
+    """
+    if field == "tags":
+        return normalize_tags(value) == normalize_tags(other_value)
+
+    return value == other_value
+
+
+def merge_edits(photo_edits, photo_id, key, edits):
+    """
+    Merge the edits of mapping entry into the edits of the photo
+    (dictionary mapping photo IDs to tuples of the merged edits
+    and the keys of the entries they came from).
+    :return: list of conflicts with the edits merged previously
+    """
+    merged, keys = photo_edits.setdefault(photo_id, ({}, []))
+    conflicts = []
+    for field, value in edits.items():
+        if field in merged and not is_same_value(field, merged[field], value):
+            conflicts.append(
+                f"photo {photo_id} {field}: {merged[field]!r} "
+                f"(from {', '.join(repr(k) for k in keys)}) vs {value!r} "
+                f"(from '{key}')"
+            )
+            continue
+        merged[field] = value
+    keys.append(key)
+
+    return conflicts
+
+
+def resolve_edits(photos, mapping):
+    """
+    Match the entries of the mapping to the photos of the album by photo ID
+    or title. The edits of entries matching the same photo are merged.
+    Throws ValueError if such entries set the same field to different values.
+    :return: list of (photo ID, changes) tuples for the photos to be changed
+    """
+    logger = logging.getLogger(__name__)
+
+    photos_by_id = {}
+    photos_by_title = {}
+    for photo in photos:
+        photos_by_id[photo["id"]] = photo
+        photos_by_title.setdefault(photo.get("title"), []).append(photo)
+
+    photo_edits = {}
+    conflicts = []
+    for key, edits in mapping:
+        if key in photos_by_id:
+            matched = [photos_by_id[key]]
+        else:
+            matched = photos_by_title.get(key, [])
+
+        if len(matched) == 0:
+            logger.error(f"No photo in the album matches '{key}'")
+            continue
+        if len(matched) > 1:
+            logger.warning(f"Multiple photos match '{key}', editing all of them")
+
+        for photo in matched:
+            conflicts.extend(merge_edits(photo_edits, photo["id"], key, edits))
+
+    if conflicts:
+        raise ValueError("conflicting edits: " + "; ".join(conflicts))
+
+    ret = []
+    for photo_id, (edits, _) in photo_edits.items():
+        changes = get_changes(photos_by_id[photo_id], edits)
+        if changes:
+            ret.append((photo_id, changes))
+        else:
+            logger.debug(f"Photo {photo_id} is up to date")
+
+    return ret
+
+
+def edit_photo(flickr, photo_id, changes, retries, progress_bar):
+    """
+    worker function to apply the changes to single photo and report progress
+    """
+    logger = logging.getLogger(__name__)
+
+    for i in range(1, retries + 2):
+        try:
+            if "title" in changes or "description" in changes:
+                set_photo_meta(
+                    flickr,
+                    photo_id,
+                    title=changes.get("title", (None, None))[1],
+                    description=changes.get("description", (None, None))[1],
+                )
+            if "tags" in changes:
+                set_photo_tags(flickr, photo_id, changes["tags"][1])
+            break
+        except flickrapi.FlickrError as exc:
+            logger.debug(
+                f"Failed to edit photo {photo_id} (try {i}/{retries + 1}): {exc}"
+            )
+            if i == retries + 1:
+                raise exc
+
+    progress_bar()
+
+
+def print_changes(edits):
+    """
+    print the changes to be made
+    """
+    for photo_id, changes in edits:
+        for field, (old_value, new_value) in changes.items():
+            print(f"{photo_id} {field}: {old_value!r} -> {new_value!r}")
+
+
+def edit_metadata():
+    """
+    command line tool to edit metadata of photos in an album
+    """
+    args = get_args()
+
+    logger = get_package_logger(args.loglevel)
+
+    try:
+        mapping = load_mapping(args.mapping)
+    except (OSError, ValueError) as exc:
+        logger.error(f"Cannot load the mapping from '{args.mapping}': {exc}")
+        sys.exit(1)
+
+    check_env(flickrKey, flickrSecret)
+
+    logger.info("Checking authentication")
+    flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
+    auth_check(flickr, perms="write")
+
+    album_id = get_album_id(
+        flickr, args.name, mirror_path=args.db if args.cached else None
+    )
+    if album_id is None:
+        sys.exit(1)
+
+    logger.info("Getting photos in the album")
+    photos = get_album_photos(flickr, album_id, extras=["description", "tags"])
+    try:
+        edits = resolve_edits(photos, mapping)
+    except ValueError as exc:
+        logger.error(exc)
+        sys.exit(1)
+    logger.info(f"{len(edits)} photos need to be changed")
+
+    if args.dry_run:
+        print_changes(edits)
+        return
+
+    failed = 0
+    with alive_bar(len(edits)) as progress_bar:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            tasks = run_windowed(
+                executor,
+                edit_photo,
+                (
+                    (flickr, photo_id, changes, args.retries, progress_bar)
+                    for photo_id, changes in edits
+                ),
+                args.threads,
+            )
+            for (_, photo_id, _, _, _), future in tasks:
+                try:
+                    future.result()
+                except flickrapi.FlickrError as exc:
+                    logger.error(f"Failed to edit photo {photo_id}: {exc}")
+                    failed = failed + 1
+
+    logger.info(f"Edited {len(edits) - failed} photos")
+
+    log_remaining_calls(flickr)
+
+    if failed > 0:
+        sys.exit(1)
@@ -7,34 +7,210 @@ Functions that wrap around Flickr API
 """
 
 import logging
+import operator
 import os
+import threading
 import webbrowser
+from collections import namedtuple
 from xml.etree import ElementTree
 
 import flickrapi
 
+from .bandwidth import ThrottledFile
+from .mirror import PhotoMirror
+from .quota import ApiQuota, get_quota_path
 
-def get_albums(flickr_handle):
+# Lightweight record for album (photoset) entry of the album list.
+Album = namedtuple("Album", ["id", "title", "photos", "videos", "date_update"])
+
+_quotas = {}
+_quotas_lock = threading.Lock()
+
+
+def _get_quota(flickr_handle):
     """
-    Return dictionary of albums. Names map to IDs.
+    return ApiQuota object for the API key of the Flickr handle
+    """
+    api_key = flickr_handle.flickr_oauth.key
+    with _quotas_lock:
+        quota = _quotas.get(api_key)
+        if quota is None:
+            quota = ApiQuota(get_quota_path(api_key))
+            _quotas[api_key] = quota
+
+    return quota
+
+
+def get_remaining_calls(flickr_handle):
+    """
+    return number of API calls remaining in the current hour,
+    as counted by all local processes using the same API key,
+    or None if the calls are not limited
     """
+    return _get_quota(flickr_handle).remaining()
 
+
+def log_remaining_calls(flickr_handle):
+    """
+    log number of API calls remaining in the current hour
+    """
     logger = logging.getLogger(__name__)
 
-    ret = {}
+    remaining = get_remaining_calls(flickr_handle)
+    if remaining is not None:
+        logger.info(f"API calls remaining in the current hour: {remaining}")
+
+
+def _call(flickr_handle, method, **params):
+    """
+    Call given Flickr API method (e.g. "photosets.getList") and return
+    the response parsed from JSON into dictionary.
+
+    Parsing JSON is much cheaper than building ElementTree of the XML response.
+
+    The call is paced so that the API quota is not exceeded.
+
+    Throws FlickrError on error.
+    """
+    _get_quota(flickr_handle).acquire()
+    api_method = operator.attrgetter(method)(flickr_handle)
+    return api_method(format="parsed-json", **params)
+
+
+def _content(value):
+    """
+    return text content of JSON response element, e.g. {"_content": "foo"}
+    """
+    if isinstance(value, dict):
+        return value.get("_content")
+
+    return value
+
+
+def get_album_list(flickr_handle):
+    """
+    Return list of Album records.
+    """
+
+    logger = logging.getLogger(__name__)
 
     # Note: paging is not used currently. According to the API documentation
     #       this will return all photosets however this may change in the
     #       future.
-    res = flickr_handle.photosets.getList()
-    photosets_elem = res.find("photosets")
-    for photoset_elem in list(photosets_elem.iter("photoset")):
-        logger.debug(ElementTree.tostring(photoset_elem, "utf-8"))
-        title_elem = photoset_elem.find("title")
-        if title_elem is not None:
-            ret[title_elem.text] = photoset_elem.attrib["id"]
+    res = _call(flickr_handle, "photosets.getList")
+    albums = [
+        Album(
+            photoset["id"],
+            _content(photoset.get("title")),
+            int(photoset.get("photos", 0)),
+            int(photoset.get("videos", 0)),
+            photoset.get("date_update"),
+        )
+        for photoset in res["photosets"].get("photoset", [])
+    ]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Albums: {albums}")
+
+    return albums
+
+
+def get_albums(flickr_handle, mirror_path=None):
+    """
+    Return dictionary of albums. Names map to IDs.
+    If path to the local mirror is given, the albums are looked up in the mirror
+    instead, as of its last synchronization. Returns None if the mirror
+    was not synchronized yet.
+    """
+    logger = logging.getLogger(__name__)
+
+    if mirror_path is not None:
+        with PhotoMirror(mirror_path) as mirror:
+            if mirror.is_empty():
+                logger.error(f"Mirror '{mirror_path}' was not synchronized yet")
+                return None
+            return mirror.get_albums()
+
+    return {
+        album.title: album.id
+        for album in get_album_list(flickr_handle)
+        if album.title is not None
+    }
+
+
+def _get_pages(flickr_handle, method, container, extras=None, per_page=500, **params):
+    """
+    Generate photos from paginated API method as dictionaries of photo attributes
+    (id, title and the requested extras) with text content of the elements
+    (e.g. description) unwrapped. The photos are retrieved one page at a time
+    so the results do not have to be held in memory.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    if extras:
+        params["extras"] = ",".join(extras)
+
+    page = 1
+    while True:
+        logger.debug(f"Getting page {page} of {method}")
+        res = _call(flickr_handle, method, page=page, per_page=per_page, **params)
+        photos = res[container]
+        for photo in photos.get("photo", []):
+            yield {key: _content(value) for key, value in photo.items()}
 
-    return ret
+        if page >= int(photos.get("pages", 1)):
+            break
+        page = page + 1
+
+
+def get_album_photos(flickr_handle, album_id, extras=None, per_page=500):
+    """
+    Generate photos of given album as dictionaries of photo attributes.
+    """
+
+    return _get_pages(
+        flickr_handle,
+        "photosets.getPhotos",
+        "photoset",
+        extras=extras,
+        per_page=per_page,
+        photoset_id=album_id,
+    )
+
+
+def get_photostream(flickr_handle, extras=None, min_upload_date=None):
+    """
+    Generate photos of the authenticated user as dictionaries of photo attributes,
+    optionally only those uploaded since given time (Unix timestamp).
+    """
+
+    params = {}
+    if min_upload_date is not None:
+        params["min_upload_date"] = min_upload_date
+
+    return _get_pages(
+        flickr_handle,
+        "people.getPhotos",
+        "photos",
+        extras=extras,
+        user_id="me",
+        **params,
+    )
+
+
+def get_updated_photos(flickr_handle, min_date, extras=None):
+    """
+    Generate photos of the authenticated user modified since given time
+    (Unix timestamp) as dictionaries of photo attributes.
+    """
+
+    return _get_pages(
+        flickr_handle,
+        "photos.recentlyUpdated",
+        "photos",
+        extras=extras,
+        min_date=min_date,
+    )
 
 
 def create_album(flickr_handle, title, primary_photo_id):
@@ -47,15 +223,20 @@ def create_album(flickr_handle, title, primary_photo_id):
     logger.info(f"Creating album '{title}' with primary photo ID {primary_photo_id}")
     # Note: The album creation needs primary photo ID.
     # The photo will be automatically added to the album.
-    res = flickr_handle.photosets.create(title=title, primary_photo_id=primary_photo_id)
-    album_id = res.find("photoset").attrib["id"]
+    res = _call(
+        flickr_handle,
+        "photosets.create",
+        title=title,
+        primary_photo_id=primary_photo_id,
+    )
+    album_id = res["photoset"].get("id")
     if album_id is not None:
         logger.info(f"Created album '{title}' with ID {album_id}")
 
     return album_id
 
 
-# pylint: disable=R0913
+# pylint: disable=R0913,R0914
 def upload_photo(
     flickr_handle,
     file_path,
@@ -64,11 +245,15 @@ def upload_photo(
     tags=None,
     dedup=False,
     retries=0,
+    bucket=None,
 ):
     """
     Upload given file to Flickr. If title is not specified, it will be set
     to the basename of the file path.
 
+    If bucket is specified, the data of the file are read at the rate
+    allowed by the token bucket.
+
     return photo ID or None.
 
     Note that Flickr automatically adds description based on EXIF data.
@@ -104,8 +289,13 @@ def upload_photo(
             # Reopen the file with each attempt. This is necessary because the data
             # the file object might have been already read.
             with open(file_path, "rb") as file_obj:
+                if bucket is not None:
+                    file_obj = ThrottledFile(file_obj, bucket)
+                # The upload endpoint responds only with XML.
+                _get_quota(flickr_handle).acquire()
                 rsp = flickr_handle.upload(file_path, fileobj=file_obj, **params)
-                logger.debug(ElementTree.tostring(rsp, "utf-8"))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(ElementTree.tostring(rsp, "utf-8"))
                 photo_id = rsp.find("photoid")
                 if photo_id is not None:
                     res = photo_id.text
@@ -134,7 +324,7 @@ def delete_photo(flickr_handle, photo_id):
     logger = logging.getLogger(__name__)
 
     logger.debug(f"Deleting file with photo ID {photo_id})")
-    flickr_handle.photos.delete(photo_id=photo_id)
+    _call(flickr_handle, "photos.delete", photo_id=photo_id)
 
 
 def delete_album(flickr_handle, album_id):
@@ -144,7 +334,58 @@ def delete_album(flickr_handle, album_id):
     logger = logging.getLogger(__name__)
 
     logger.debug(f"Deleting album with ID {album_id})")
-    flickr_handle.photosets.delete(photoset_id=album_id)
+    _call(flickr_handle, "photosets.delete", photoset_id=album_id)
+
+
+def set_photo_meta(flickr_handle, photo_id, title=None, description=None):
+    """
+    Set title and/or description of the photo.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"Setting metadata of photo {photo_id}")
+    params = {}
+    if title is not None:
+        params["title"] = title
+    if description is not None:
+        params["description"] = description
+    _call(flickr_handle, "photos.setMeta", photo_id=photo_id, **params)
+
+
+def set_photo_tags(flickr_handle, photo_id, tags):
+    """
+    Replace the tags of the photo with the tags (space separated string,
+    multi-word tags in double quotes).
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"Setting tags of photo {photo_id}")
+    _call(flickr_handle, "photos.setTags", photo_id=photo_id, tags=tags)
+
+
+def add_to_album(flickr_handle, album_id, photo_id):
+    """
+    Add photo to album.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"Adding photo {photo_id} to album {album_id}")
+    _call(flickr_handle, "photosets.addPhoto", photoset_id=album_id, photo_id=photo_id)
+
+
+def reorder_album(flickr_handle, album_id, photo_ids):
+    """
+    Set the order of the photos in the album according to the list of photo IDs.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"Reordering {len(photo_ids)} photos in album {album_id}")
+    _call(
+        flickr_handle,
+        "photosets.reorderPhotos",
+        photoset_id=album_id,
+        photo_ids=",".join(photo_ids),
+    )
 
 
 def auth_check(flickr_handle, perms="read"):
@@ -171,15 +412,15 @@ def auth_check(flickr_handle, perms="read"):
         flickr_handle.get_access_token(verifier)
 
 
-def get_album_id(flickr, album_name):
+def get_album_id(flickr, album_name, mirror_path=None):
     """
-    return ID for album name
+    return ID for album name, optionally looked up in the local mirror
     """
 
     logger = logging.getLogger(__name__)
 
     logger.info("Getting list of albums")
-    albums = get_albums(flickr)
+    albums = get_albums(flickr, mirror_path=mirror_path)
     if albums is None or len(albums.items()) == 0:
         logger.error("Empty list of albums")
         return None
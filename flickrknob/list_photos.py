@@ -2,40 +2,252 @@
 
 """
 
-This program lists all photos in given album.
+This program lists all photos in given albums.
+
+Besides the titles, the photos can be exported along with their metadata
+as JSON Lines or CSV. The albums are retrieved concurrently and the rows
+are written out as soon as each page of the results arrives.
 
 """
 
 import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from decouple import config
 
 import flickrapi
 
-from .flickrknob import auth_check, get_album_id
+from .flickrknob import (
+    auth_check,
+    get_album_photos,
+    get_albums,
+    log_remaining_calls,
+)
 from .logutil import get_package_logger
+from .mirror import MIRROR_PATH, PhotoMirror
 from .parserutil import get_base_parser
-from .utils import check_env, parse_args
+from .utils import check_env, get_album_names, parse_args, run_windowed
 
 flickrKey = config("FLICKR_KEY")
 flickrSecret = config("FLICKR_SECRET")
 
+# Extras to request from the API and the photo attributes to export.
+EXTRAS = ["date_taken", "original_format", "o_dims", "views", "url_o"]
+FIELDS = [
+    "album",
+    "id",
+    "title",
+    "datetaken",
+    "originalformat",
+    "o_width",
+    "o_height",
+    "views",
+    "url_o",
+]
 
-def list_album_photos():
+# Maximum number of rows waiting to be written out.
+MAX_PENDING_ROWS = 10000
+
+# How often (in seconds) the workers blocked on full queue check
+# whether they should stop.
+STOP_CHECK_INTERVAL = 1
+
+
+def get_args():
     """
-    command line tool to list photos in an album
+    return parsed arguments from command line
     """
     parser = argparse.ArgumentParser(
         add_help=False,
-        description="list photos in Flickr album and",
+        description="list photos in Flickr albums",
         parents=[get_base_parser()],
     )
-    parser.add_argument("name")
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        default=False,
+        help="list photos in all albums",
+    )
+    parser.add_argument(
+        "--cached",
+        action="store_true",
+        default=False,
+        help="answer from the local mirror (see mirror_photos) "
+        "without contacting Flickr",
+    )
+    parser.add_argument("--db", help="Path to the mirror database", default=MIRROR_PATH)
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["text", "jsonl", "csv"],
+        default="text",
+        help="output format; text lists just the titles "
+        "(prefixed with album name if listing multiple albums)",
+    )
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+    parser.add_argument("name", nargs="*", help="album name")
 
     args = parse_args(parser)
+    if not args.all and not args.name:
+        parser.error("specify album names or --all")
+
+    return args
+
+
+def get_photo_row(album_name, photo):
+    """
+    return dictionary with the exported fields of the photo
+    """
+    row = {field: photo.get(field) for field in FIELDS}
+    row["album"] = album_name
+
+    return row
+
+
+def put_row(rows, row, stop):
+    """
+    Put the row to the queue, waiting for free space unless the stop event is set.
+    :return: False if the row was not put to the queue because of the stop event
+    """
+    while not stop.is_set():
+        try:
+            rows.put(row, timeout=STOP_CHECK_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+# pylint: disable=R0913
+def fetch_album_rows(flickr, album_name, album_id, extras, rows, stop):
+    """
+    worker function to put rows for the photos in the album to the queue.
+    None is put to the queue once the album is done.
+    The worker returns early if the stop event is set.
+    """
+    try:
+        if stop.is_set():
+            return
+        for photo in get_album_photos(flickr, album_id, extras=extras):
+            if photo.get("id") and not put_row(
+                rows, get_photo_row(album_name, photo), stop
+            ):
+                return
+    finally:
+        put_row(rows, None, stop)
+
+
+# pylint: disable=R0913
+def fetch_albums(executor, numworkers, flickr, albums, album_names, extras, rows, stop):
+    """
+    Run the album workers through bounded window of tasks until all albums
+    are done or the stop event is set.
+    :return: number of albums that failed
+    """
+    logger = logging.getLogger(__name__)
+
+    failed = 0
+    tasks = run_windowed(
+        executor,
+        fetch_album_rows,
+        (
+            (flickr, album_name, albums[album_name], extras, rows, stop)
+            for album_name in itertools.takewhile(
+                lambda _: not stop.is_set(), album_names
+            )
+        ),
+        numworkers,
+    )
+    try:
+        for (_, album_name, _, _, _, _), future in tasks:
+            try:
+                future.result()
+            except Exception as exc:  # pylint: disable=W0718
+                logger.error(f"Failed to list album '{album_name}': {exc}")
+                failed = failed + 1
+            if stop.is_set():
+                break
+    finally:
+        # Cancel the queued tasks.
+        tasks.close()
+
+    return failed
 
-    logger = get_package_logger(args.loglevel)
+
+def drain_rows(rows, num_albums):
+    """
+    Generate the rows from the queue until all albums are done.
+    """
+    while num_albums > 0:
+        row = rows.get()
+        if row is None:
+            num_albums = num_albums - 1
+            continue
+
+        yield row
+
+
+def write_rows(rows, output_format, with_album=False):
+    """
+    Write the rows to standard output. In the text format, the titles
+    are prefixed with the album name if with_album is True.
+    """
+    if output_format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+        writer.writeheader()
+
+    for row in rows:
+        if output_format == "csv":
+            writer.writerow(row)
+        elif output_format == "jsonl":
+            print(json.dumps(row))
+        elif with_album:
+            print(f"{row['album']}: {row['title']}")
+        else:
+            print(row["title"])
+
+
+def list_cached_photos(args):
+    """
+    list the photos from the local mirror
+    """
+    logger = logging.getLogger(__name__)
+
+    with PhotoMirror(args.db) as mirror:
+        if mirror.is_empty():
+            logger.error(f"Mirror '{args.db}' was not synchronized yet")
+            sys.exit(1)
+
+        albums = mirror.get_albums()
+        album_names = get_album_names(albums, args)
+        write_rows(
+            (
+                get_photo_row(album_name, photo)
+                for album_name in album_names
+                for photo in mirror.get_album_photos(albums[album_name])
+            ),
+            args.format,
+            with_album=len(album_names) > 1,
+        )
+
+
+def list_photos(args):
+    """
+    list the photos in the albums
+    """
+    logger = logging.getLogger(__name__)
 
     check_env(flickrKey, flickrSecret)
 
@@ -43,15 +255,70 @@ def list_album_photos():
     flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
     auth_check(flickr)
 
-    album_id = get_album_id(flickr, args.name)
-    if album_id is None:
+    logger.info("Getting list of albums")
+    albums = get_albums(flickr)
+    album_names = get_album_names(albums, args)
+
+    # The titles are part of the basic response.
+    extras = EXTRAS if args.format != "text" else None
+
+    logger.info(f"Getting photos of {len(album_names)} albums")
+    # The queue is bounded so that the workers cannot get too far ahead
+    # of the output.
+    rows = queue.Queue(maxsize=MAX_PENDING_ROWS)
+    stop = threading.Event()
+    # The workers are fed by separate thread so that the output can be written
+    # as the rows arrive. The feeder is shut down first so that it does not
+    # submit tasks to executor that is already shut down.
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        with ThreadPoolExecutor(max_workers=1) as feeder:
+            feeder_future = feeder.submit(
+                fetch_albums,
+                executor,
+                args.threads,
+                flickr,
+                albums,
+                album_names,
+                extras,
+                rows,
+                stop,
+            )
+            try:
+                write_rows(
+                    drain_rows(rows, len(album_names)),
+                    args.format,
+                    with_album=len(album_names) > 1,
+                )
+            finally:
+                # Make the workers exit and the queued ones skip the API calls
+                # rather than wait for the output forever if the writing failed
+                # or was interrupted.
+                stop.set()
+
+    failed = feeder_future.result()
+
+    log_remaining_calls(flickr)
+
+    if failed > 0:
         sys.exit(1)
 
-    logger.info("Getting photo IDs")
-    res = flickr.photosets.getPhotos(photoset_id=album_id)
-    photoset_elem = res.find("photoset")
-    logger.debug(f"photoset elem: {photoset_elem}")
-    for photo_elem in list(photoset_elem.iter("photo")):
-        photo_id = photo_elem.attrib.get("id")
-        if photo_id:
-            print(photo_elem.attrib["title"])
+
+def list_album_photos():
+    """
+    command line tool to list photos in albums
+    """
+    args = get_args()
+
+    get_package_logger(args.loglevel)
+
+    try:
+        if args.cached:
+            list_cached_photos(args)
+        else:
+            list_photos(args)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader of the output went away (e.g. head). Redirect the output
+        # so that flushing it at exit does not fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
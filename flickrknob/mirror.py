@@ -0,0 +1,253 @@
+"""
+
+Local mirror of the photos and albums of the account.
+
+The mirror is stored in SQLite database. It is filled by paginated calls
+with the photo attributes requested as extras and then updated incrementally
+using the upload and last update times of the photos as cursors.
+
+"""
+
+import logging
+import os
+import sqlite3
+
+MIRROR_PATH = os.path.expanduser(os.path.join("~", ".flickr", "mirror.db"))
+
+# Extras to request from the API.
+EXTRAS = [
+    "date_upload",
+    "last_update",
+    "date_taken",
+    "original_format",
+    "o_dims",
+    "views",
+    "url_o",
+]
+
+# Photo attributes (as returned with the extras) stored in the mirror.
+PHOTO_COLUMNS = [
+    "id",
+    "title",
+    "dateupload",
+    "lastupdate",
+    "datetaken",
+    "originalformat",
+    "o_width",
+    "o_height",
+    "views",
+    "url_o",
+]
+
+
+class PhotoMirror:
+    """
+    SQLite backed mirror of photos and albums.
+    """
+
+    def __init__(self, path=MIRROR_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS photos ("
+                "id TEXT PRIMARY KEY, "
+                "title TEXT, "
+                "dateupload INTEGER, "
+                "lastupdate INTEGER, "
+                "datetaken TEXT, "
+                "originalformat TEXT, "
+                "o_width INTEGER, "
+                "o_height INTEGER, "
+                "views INTEGER, "
+                "url_o TEXT)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS photos_title ON photos (title)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS albums ("
+                "id TEXT PRIMARY KEY, "
+                "title TEXT, "
+                "photos INTEGER, "
+                "videos INTEGER, "
+                "date_update INTEGER)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS album_photos ("
+                "album_id TEXT NOT NULL, "
+                "photo_id TEXT NOT NULL, "
+                "position INTEGER NOT NULL, "
+                "PRIMARY KEY (album_id, photo_id))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS album_photos_photo "
+                "ON album_photos (photo_id)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        close the database connection
+        """
+        self.conn.close()
+
+    def get_meta(self, key):
+        """
+        return value stored for the key or None
+        """
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        return row[0]
+
+    def set_meta(self, key, value):
+        """
+        store value for the key
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def is_empty(self):
+        """
+        return whether the mirror was never synchronized
+        """
+        return self.get_meta("synced") is None
+
+    def store_photos(self, photos):
+        """
+        Insert or update the photos (dictionaries of photo attributes).
+        :return: tuple of the number of photos stored and the maximum
+        upload and last update times seen
+        """
+        count = 0
+        max_upload = 0
+        max_update = 0
+        with self.conn:
+            for photo in photos:
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO photos ({', '.join(PHOTO_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(PHOTO_COLUMNS))})",
+                    [photo.get(column) for column in PHOTO_COLUMNS],
+                )
+                count = count + 1
+                max_upload = max(max_upload, int(photo.get("dateupload") or 0))
+                max_update = max(max_update, int(photo.get("lastupdate") or 0))
+
+        return count, max_upload, max_update
+
+    def retain_photos(self, photo_ids):
+        """
+        Remove photos not in the set of photo IDs.
+        :return: number of photos removed
+        """
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS retained (id TEXT)")
+            self.conn.execute("DELETE FROM retained")
+            self.conn.executemany(
+                "INSERT INTO retained (id) VALUES (?)",
+                ((photo_id,) for photo_id in photo_ids),
+            )
+            cursor = self.conn.execute(
+                "DELETE FROM photos WHERE id NOT IN (SELECT id FROM retained)"
+            )
+            return cursor.rowcount
+
+    def get_album_updates(self):
+        """
+        return dictionary mapping album IDs to their last update times
+        """
+        return dict(self.conn.execute("SELECT id, date_update FROM albums"))
+
+    def store_album(self, album, photo_ids):
+        """
+        Insert or update the album (Album record) along with the list
+        of its photo IDs.
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO albums (id, title, photos, videos, date_update) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (album.id, album.title, album.photos, album.videos, album.date_update),
+            )
+            self.conn.execute(
+                "DELETE FROM album_photos WHERE album_id = ?", (album.id,)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO album_photos (album_id, photo_id, position) "
+                "VALUES (?, ?, ?)",
+                ((album.id, photo_id, i) for i, photo_id in enumerate(photo_ids)),
+            )
+
+    def remove_albums(self, album_ids):
+        """
+        Remove the albums along with their photo lists.
+        """
+        with self.conn:
+            for album_id in album_ids:
+                self.conn.execute("DELETE FROM albums WHERE id = ?", (album_id,))
+                self.conn.execute(
+                    "DELETE FROM album_photos WHERE album_id = ?", (album_id,)
+                )
+
+    def get_albums(self):
+        """
+        Return dictionary of albums. Names map to IDs.
+        """
+        return {
+            row["title"]: row["id"]
+            for row in self.conn.execute("SELECT id, title FROM albums")
+        }
+
+    def get_album_photos(self, album_id):
+        """
+        Generate photos of the album in the album order as dictionaries
+        of photo attributes.
+        """
+        logger = logging.getLogger(__name__)
+
+        columns = ", ".join(f"p.{column}" for column in PHOTO_COLUMNS)
+        cursor = self.conn.execute(
+            f"SELECT {columns} FROM album_photos a "
+            "LEFT JOIN photos p ON p.id = a.photo_id "
+            "WHERE a.album_id = ? ORDER BY a.position",
+            (album_id,),
+        )
+        for row in cursor:
+            if row["id"] is None:
+                logger.debug(f"Photo of album {album_id} missing in the mirror")
+                continue
+            yield dict(row)
+
+    def find_titles(self, titles):
+        """
+        return dictionary mapping those of the titles that belong to some photo
+        to the photo ID
+        """
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (title TEXT)")
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.executemany(
+                "INSERT INTO wanted (title) VALUES (?)", ((title,) for title in titles)
+            )
+            return dict(
+                self.conn.execute(
+                    "SELECT p.title, p.id FROM photos p "
+                    "JOIN wanted w ON w.title = p.title"
+                )
+            )
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+
+This program maintains local mirror of the photos and albums of the account
+and answers queries from it.
+
+The first run retrieves all the photos and albums, subsequent runs retrieve
+only the photos uploaded or modified since the previous run and the albums
+updated since then.
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+
+import flickrapi
+
+from .flickrknob import (
+    auth_check,
+    get_album_list,
+    get_album_photos,
+    get_photostream,
+    get_updated_photos,
+    log_remaining_calls,
+)
+from .logutil import get_package_logger
+from .mirror import EXTRAS, MIRROR_PATH, PhotoMirror
+from .parserutil import get_base_parser
+from .uploader import get_dir_entries
+from .utils import check_dir, check_env, parse_args, run_windowed
+
+flickrKey = config("FLICKR_KEY")
+flickrSecret = config("FLICKR_SECRET")
+
+
+def get_args():
+    """
+    return parsed arguments from command line
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        description="maintain and query local mirror of Flickr photos and albums",
+        parents=[get_base_parser()],
+    )
+    parser.add_argument("--db", help="Path to the mirror database", default=MIRROR_PATH)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="retrieve everything again (also removes deleted photos)",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=False,
+        help="do not synchronize the mirror, just answer the query",
+    )
+    parser.add_argument(
+        "--check",
+        metavar="DIR",
+        help="list files in the directory that are already on Flickr "
+        "(matched by file name to photo title)",
+    )
+    parser.add_argument(
+        "--missing",
+        action="store_true",
+        default=False,
+        help="with --check, list the files that are not on Flickr instead",
+    )
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+
+    return parse_args(parser)
+
+
+def sync_photos(flickr, mirror, full):
+    """
+    Retrieve the photos uploaded or modified since the last synchronization
+    (all photos if full is True or the mirror is empty) and store them
+    in the mirror.
+    """
+    logger = logging.getLogger(__name__)
+
+    last_upload = int(mirror.get_meta("last_upload") or 0)
+    last_update = int(mirror.get_meta("last_update") or 0)
+
+    if full or mirror.is_empty():
+        logger.info("Getting all photos")
+        seen = set()
+
+        def track(photos):
+            for photo in photos:
+                seen.add(photo["id"])
+                yield photo
+
+        count, max_upload, max_update = mirror.store_photos(
+            track(get_photostream(flickr, extras=EXTRAS))
+        )
+        logger.info(f"Stored {count} photos")
+        removed = mirror.retain_photos(seen)
+        if removed > 0:
+            logger.info(f"Removed {removed} deleted photos")
+    else:
+        logger.info("Getting new photos")
+        count, max_upload, max_update = mirror.store_photos(
+            get_photostream(flickr, extras=EXTRAS, min_upload_date=last_upload)
+        )
+        logger.info(f"Stored {count} new photos")
+
+        logger.info("Getting updated photos")
+        count, _, updated = mirror.store_photos(
+            get_updated_photos(flickr, last_update, extras=EXTRAS)
+        )
+        logger.info(f"Stored {count} updated photos")
+        max_update = max(max_update, updated)
+
+    mirror.set_meta("last_upload", str(max(last_upload, max_upload)))
+    mirror.set_meta("last_update", str(max(last_update, max_update)))
+
+
+def get_album_photo_ids(flickr, album_id):
+    """
+    worker function to return list of photo IDs in the album
+    """
+    return [photo["id"] for photo in get_album_photos(flickr, album_id)]
+
+
+def sync_albums(flickr, mirror, full, numworkers):
+    """
+    Store the list of albums in the mirror and retrieve the photo lists
+    of the albums that changed since the last synchronization.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.info("Getting list of albums")
+    albums = get_album_list(flickr)
+    stored = mirror.get_album_updates()
+
+    changed = [
+        album
+        for album in albums
+        if full or str(stored.get(album.id)) != str(album.date_update)
+    ]
+    logger.info(f"Getting photo lists of {len(changed)} albums")
+    with ThreadPoolExecutor(max_workers=numworkers) as executor:
+        tasks = run_windowed(
+            executor,
+            get_album_photo_ids,
+            ((flickr, album.id) for album in changed),
+            numworkers,
+        )
+        albums_by_id = {album.id: album for album in changed}
+        for (_, album_id), future in tasks:
+            mirror.store_album(albums_by_id[album_id], future.result())
+
+    removed = set(stored.keys()) - {album.id for album in albums}
+    if removed:
+        logger.info(f"Removing {len(removed)} deleted albums")
+        mirror.remove_albums(removed)
+
+
+def check_files(mirror, dir_name, missing):
+    """
+    Print the files in the directory that are (or are not, if missing is True)
+    present in the mirror as photos with the file name as title.
+    """
+    check_dir(dir_name)
+    dir_entries = get_dir_entries(dir_name)
+    found = mirror.find_titles(os.path.basename(path) for path in dir_entries)
+    for path in sorted(dir_entries):
+        photo_id = found.get(os.path.basename(path))
+        if missing and photo_id is None:
+            print(path)
+        elif not missing and photo_id is not None:
+            print(f"{path} {photo_id}")
+
+
+def mirror_photos():
+    """
+    command line tool to maintain and query the mirror
+    """
+    args = get_args()
+
+    logger = get_package_logger(args.loglevel)
+
+    with PhotoMirror(args.db) as mirror:
+        if not args.offline:
+            check_env(flickrKey, flickrSecret)
+
+            logger.info("Checking authentication")
+            flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
+            auth_check(flickr)
+
+            try:
+                sync_photos(flickr, mirror, args.full)
+                sync_albums(flickr, mirror, args.full, args.threads)
+            except flickrapi.FlickrError as exc:
+                logger.error(f"Failed to synchronize the mirror: {exc}")
+                sys.exit(1)
+            mirror.set_meta("synced", "1")
+
+            log_remaining_calls(flickr)
+        elif mirror.is_empty():
+            logger.error(f"Mirror '{args.db}' was not synchronized yet")
+            sys.exit(1)
+
+        if args.check:
+            check_files(mirror, args.check, args.missing)
@@ -5,7 +5,9 @@ argument parser utility functions
 import argparse
 import logging
 
+from .bandwidth import parse_rate, parse_schedule
 from .logutil import LogLevelAction
+from .mirror import MIRROR_PATH
 
 
 def get_base_parser():
@@ -25,3 +27,45 @@ def get_base_parser():
     )
 
     return parser
+
+
+def get_rate_parser():
+    """
+    return parser with the arguments for bandwidth shaping of uploads
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+
+    parser.add_argument(
+        "--max-rate",
+        help="Maximum upload rate for all threads together in bytes per second "
+        "with optional K/M/G suffix (0 means unlimited)",
+        type=parse_rate,
+        default=None,
+    )
+    parser.add_argument(
+        "--rate-schedule",
+        help="Time of day schedule of upload rates overriding --max-rate, "
+        'e.g. "08:00-18:00=1M,18:00-22:00=4M"',
+        type=parse_schedule,
+        default=None,
+    )
+
+    return parser
+
+
+def get_cache_parser():
+    """
+    return parser with the arguments for looking up the albums in the local mirror
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+
+    parser.add_argument(
+        "--cached",
+        action="store_true",
+        default=False,
+        help="look up the album in the local mirror (see mirror_photos) "
+        "instead of retrieving the list of albums from Flickr",
+    )
+    parser.add_argument("--db", help="Path to the mirror database", default=MIRROR_PATH)
+
+    return parser
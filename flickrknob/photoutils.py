@@ -6,10 +6,33 @@ Utility functions for working with photo files.
 
 import logging
 import os.path
+import struct
 from datetime import datetime
 
 import exifread
 
+# Flickr limits for the size of uploaded files.
+PHOTO_SIZE_LIMIT = 200 * 1024**2
+VIDEO_SIZE_LIMIT = 1024**3
+
+JPEG_SUFFIXES = ["jpg", "jpeg"]
+VIDEO_SUFFIXES = ["mov", "mp4"]
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+# Some cameras append data after the EOI marker so it is searched for
+# in the tail of the file rather than expected at the very end.
+JPEG_TAIL_SIZE = 64 * 1024
+
+# Maximum number of top level boxes to walk through in MP4/MOV container.
+MAX_VIDEO_BOXES = 1000
+
+
+class InvalidFileError(Exception):
+    """
+    exception class to report files that cannot be uploaded
+    """
+
 
 class EXIFerror(Exception):
     """
@@ -67,6 +90,96 @@ def get_date(file_path):
         return datetime.fromtimestamp(os.path.getmtime(file_path))
 
 
+def get_suffix(file_name):
+    """
+    return lower case suffix of the file name (without the dot)
+    """
+    return os.path.splitext(file_name)[1][1:].lower()
+
+
+def check_jpeg(fobj, size):
+    """
+    Check that the JPEG file starts with SOI marker and contains EOI marker
+    near its end.
+    """
+    if fobj.read(len(JPEG_SOI)) != JPEG_SOI:
+        raise InvalidFileError("missing JPEG SOI marker")
+
+    fobj.seek(max(size - JPEG_TAIL_SIZE, 0))
+    if JPEG_EOI not in fobj.read(JPEG_TAIL_SIZE):
+        raise InvalidFileError("missing JPEG EOI marker (truncated file ?)")
+
+
+def check_video(fobj, size):
+    """
+    Walk the top level boxes (atoms) of MP4/MOV container and check that
+    they span the whole file and that the movie box is present.
+    Only the box headers are read.
+    """
+    offset = 0
+    box_types = []
+    while offset < size and len(box_types) < MAX_VIDEO_BOXES:
+        fobj.seek(offset)
+        header = fobj.read(8)
+        if len(header) < 8:
+            raise InvalidFileError(f"truncated box header at offset {offset}")
+
+        box_size, box_type = struct.unpack(">I4s", header)
+        if box_size == 1:
+            largesize = fobj.read(8)
+            if len(largesize) < 8:
+                raise InvalidFileError(f"truncated box header at offset {offset}")
+            box_size = struct.unpack(">Q", largesize)[0]
+        elif box_size == 0:
+            # The box extends to the end of the file.
+            box_size = size - offset
+
+        if not all(32 <= char < 127 for char in box_type) or box_size < 8:
+            raise InvalidFileError(f"invalid box at offset {offset}")
+
+        box_types.append(box_type.decode("ascii"))
+        offset = offset + box_size
+
+    if offset > size:
+        raise InvalidFileError(
+            f"box '{box_types[-1]}' extends beyond end of file (truncated file ?)"
+        )
+    if offset == size and "moov" not in box_types:
+        raise InvalidFileError("missing movie box")
+
+
+def validate_file(file_path):
+    """
+    Check that the file can be uploaded to Flickr, i.e. it is readable,
+    not empty, within the size limits and its content is not obviously
+    corrupted. Only bounded amount of data is read from the file.
+
+    Throws InvalidFileError describing the problem.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"Validating '{file_path}'")
+
+    suffix = get_suffix(file_path)
+    try:
+        with open(file_path, "rb") as fobj:
+            size = os.fstat(fobj.fileno()).st_size
+            if size == 0:
+                raise InvalidFileError("empty file")
+
+            limit = VIDEO_SIZE_LIMIT if suffix in VIDEO_SUFFIXES else PHOTO_SIZE_LIMIT
+            if size > limit:
+                raise InvalidFileError(f"size {size} exceeds the limit of {limit}")
+
+            if suffix in JPEG_SUFFIXES:
+                check_jpeg(fobj, size)
+            elif suffix in VIDEO_SUFFIXES:
+                check_video(fobj, size)
+    except OSError as exc:
+        # pylint: disable=W0707
+        raise InvalidFileError(f"cannot read file: {exc}")
+
+
 def is_known_suffix(file_name):
     """
     return whether given file name ends with hard-coded suffix
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+"""
+
+Upload files into single album using multiple worker processes,
+possibly running on multiple hosts.
+
+The files are distributed to the workers through a work queue stored
+in SQLite database file. The queue is first populated from a directory
+(which has to be accessible under the same path from all the workers),
+then any number of workers upload the files and report their photo IDs
+back to the queue. Once all the files are uploaded, single finalizer
+creates the album, adds the photos to it and sorts them.
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from alive_progress import alive_bar
+from decouple import config
+
+from flickrapi import FlickrAPI
+
+from .bandwidth import get_bucket
+from .flickrknob import auth_check, create_album, log_remaining_calls
+from .logutil import get_file_logger, get_package_logger
+from .parserutil import get_base_parser, get_rate_parser
+from .uploader import (
+    add_files_to_album,
+    check_album_name,
+    get_dir_entries,
+    preflight_files,
+    reorder_files,
+    sort_by_date,
+    upload_single_photo,
+    write_rejection_report,
+)
+from .utils import check_dir, check_env, parse_args
+from .workqueue import LEASED, PENDING, WorkQueue, WorkQueueError, get_worker_id
+
+flickrKey = config("FLICKR_KEY")
+flickrSecret = config("FLICKR_SECRET")
+
+
+def get_args():
+    """
+    return parsed arguments from command line
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        description="Flickr uploader with work queue shared by multiple workers",
+        parents=[get_base_parser()],
+    )
+
+    worker_parser = argparse.ArgumentParser(add_help=False)
+    worker_parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+    worker_parser.add_argument(
+        "--logfile",
+        help="Log file to record uploaded files",
+        default="files-{album_name}-{worker}.log",
+    )
+    worker_parser.add_argument(
+        "--poll",
+        help="Number of seconds to wait before checking the queue again",
+        type=int,
+        default=30,
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser(
+        "init",
+        help="populate the queue with files from directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    init_parser.add_argument(
+        "--rejected",
+        help="Report file to record files rejected by pre-flight checks",
+        default="rejected-{album_name}.log",
+    )
+    init_parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+    init_parser.add_argument("queue", help="path to the queue file")
+    init_parser.add_argument("photosetName")
+    init_parser.add_argument("sourceDir")
+
+    work_parser = subparsers.add_parser(
+        "work",
+        help="upload files from the queue",
+        parents=[worker_parser, get_rate_parser()],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    work_parser.add_argument(
+        "-D", "--dedup", action="store_true", default=False, help="deduplicate photos"
+    )
+    work_parser.add_argument(
+        "--retries",
+        help="Number of retries when single file upload fails",
+        type=int,
+        default=3,
+    )
+    work_parser.add_argument(
+        "--lease",
+        help="Number of seconds the worker holds the files without reporting back",
+        type=int,
+        default=600,
+    )
+    work_parser.add_argument(
+        "--max-attempts",
+        help="Number of times a file is leased before it is considered failed",
+        type=int,
+        default=3,
+    )
+    work_parser.add_argument(
+        "--requeue-failed",
+        action="store_true",
+        default=False,
+        help="retry files that previously failed to upload",
+    )
+    work_parser.add_argument("queue", help="path to the queue file")
+
+    finalize_parser = subparsers.add_parser(
+        "finalize",
+        help="create album from the uploaded files",
+        parents=[worker_parser],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    finalize_parser.add_argument(
+        "--wait",
+        action="store_true",
+        default=False,
+        help="wait for the workers to finish the uploads",
+    )
+    finalize_parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="take over finalization from another (crashed) finalizer",
+    )
+    finalize_parser.add_argument("queue", help="path to the queue file")
+
+    return parse_args(parser)
+
+
+def init_queue(queue, flickr, args):
+    """
+    populate the queue with checked and sorted files from the directory
+    """
+    logger = logging.getLogger(__name__)
+
+    album_name = args.photosetName
+    check_dir(args.sourceDir)
+    check_album_name(album_name, flickr)
+
+    # The workers have to be able to access the files using the same path.
+    dir_entries = get_dir_entries(os.path.abspath(args.sourceDir))
+
+    dates = {}
+    rejected = []
+    logger.info(f"Checking {len(dir_entries)} files")
+    for _ in preflight_files(dir_entries, args.threads, dates, rejected):
+        pass
+    write_rejection_report(args.rejected.format(album_name=album_name), rejected)
+    dir_entries = sort_by_date(dates)
+    if len(dir_entries) == 0:
+        logger.error("No files passed the checks")
+        sys.exit(1)
+
+    try:
+        queue.populate(album_name, dir_entries)
+    except WorkQueueError as exc:
+        logger.error(exc)
+        sys.exit(1)
+
+    logger.info(f"Queued {len(dir_entries)} files for album '{album_name}'")
+
+
+# pylint: disable=R0913,R0914
+def upload_queued_files(queue, worker, file_logger, flickr, args):
+    """
+    Upload files leased from the queue until there is nothing left to upload.
+    The worker keeps polling the queue while files are leased by other workers
+    so that it can take over files whose leases expired.
+    """
+    logger = logging.getLogger(__name__)
+
+    counts = queue.counts()
+    logger.info(f"Uploading files from queue: {counts}")
+    uploaded = 0
+    in_flight = {}
+    stopping = False
+    bucket = get_bucket(args.max_rate, args.rate_schedule)
+    with alive_bar(counts[PENDING] + counts[LEASED]) as progress_bar:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            while True:
+                try:
+                    if not stopping and len(in_flight) < args.threads:
+                        for file_path in queue.lease(
+                            worker,
+                            args.threads - len(in_flight),
+                            args.lease,
+                            max_attempts=args.max_attempts,
+                        ):
+                            future = executor.submit(
+                                upload_single_photo,
+                                file_path,
+                                progress_bar,
+                                file_logger,
+                                flickr,
+                                args.dedup,
+                                args.retries,
+                                bucket,
+                            )
+                            in_flight[future] = file_path
+
+                    if len(in_flight) == 0:
+                        if stopping or queue.is_finished():
+                            break
+                        logger.debug("Waiting for files leased by other workers")
+                        time.sleep(args.poll)
+                        continue
+
+                    # Wake up periodically to keep the leases of the files
+                    # being uploaded from expiring.
+                    done, _ = wait(
+                        in_flight, timeout=args.lease / 3, return_when=FIRST_COMPLETED
+                    )
+                except KeyboardInterrupt:
+                    # Stop leasing new files and finish the uploads in progress.
+                    # The files leased but not uploaded will be handed out
+                    # to other workers once their leases expire.
+                    logger.info(
+                        f"Interrupted, waiting for {len(in_flight)} uploads to finish"
+                    )
+                    stopping = True
+                    continue
+
+                for future in done:
+                    file_path = in_flight.pop(future)
+                    try:
+                        _, photo_id = future.result()
+                    # Failure of single upload must not take down the worker
+                    # with the results of the other uploads unreported.
+                    except Exception as exc:  # pylint: disable=W0718
+                        logger.error(f"Failed to upload '{file_path}': {exc}")
+                        queue.fail(worker, file_path, exc)
+                        continue
+
+                    if photo_id is None:
+                        queue.fail(worker, file_path, "no photo ID")
+                        continue
+
+                    queue.complete(worker, file_path, photo_id)
+                    uploaded = uploaded + 1
+
+                queue.renew(worker, in_flight.values(), args.lease)
+
+    logger.info(f"Uploaded {uploaded} files")
+    log_remaining_calls(flickr)
+    if stopping:
+        sys.exit(1)
+
+
+def finalize(queue, worker, file_logger, flickr, args):
+    """
+    Create the album from the uploaded files, add the files to it and sort them.
+    """
+    logger = logging.getLogger(__name__)
+
+    while not queue.is_finished():
+        if not args.wait:
+            logger.error(f"Uploads are not finished yet: {queue.counts()}")
+            sys.exit(1)
+        logger.info(f"Waiting for the uploads to finish: {queue.counts()}")
+        time.sleep(args.poll)
+
+    if not queue.claim_finalizer(worker, force=args.force):
+        logger.error(
+            f"Queue is being finalized by {queue.get_meta('finalizer')}, "
+            "use --force to take over"
+        )
+        sys.exit(1)
+
+    for file_path, error in queue.failures():
+        logger.error(f"File '{file_path}' failed to upload: {error}")
+
+    results = queue.results()
+    if len(results) == 0:
+        logger.error("No files were uploaded")
+        sys.exit(1)
+
+    dir_entries = [file_path for file_path, _ in results]
+    photo_ids = {
+        os.path.basename(file_path): photo_id for file_path, photo_id in results
+    }
+    primary_photo_id = results[0][1]
+    album_name = queue.get_meta("album_name")
+
+    # The album might have been created by previous finalizer that did not
+    # get to finish.
+    album_id = queue.get_meta("album_id")
+    if album_id is None:
+        album_id = create_album(
+            flickr, title=album_name, primary_photo_id=primary_photo_id
+        )
+        if album_id is None:
+            logger.error(f"Failed to create album '{album_name}'")
+            sys.exit(1)
+        queue.set_meta("album_id", album_id)
+
+    add_files_to_album(
+        album_id, file_logger, flickr, args.threads, photo_ids, primary_photo_id
+    )
+
+    # The files need to be reordered since they were uploaded in parallel.
+    reorder_files(album_id, dir_entries, flickr, photo_ids)
+
+    log_remaining_calls(flickr)
+
+
+def queue_uploader():
+    """
+    command line tool for uploading files using shared work queue
+    """
+    args = get_args()
+
+    logger = get_package_logger(args.loglevel)
+
+    check_env(flickrKey, flickrSecret)
+
+    logger.info("Checking authentication")
+    flickr = FlickrAPI(flickrKey, flickrSecret)
+    auth_check(flickr, perms="write")
+
+    worker = get_worker_id()
+    with WorkQueue(args.queue) as queue:
+        if args.command == "init":
+            init_queue(queue, flickr, args)
+            return
+
+        album_name = queue.get_meta("album_name")
+        if album_name is None:
+            logger.error(f"Queue '{args.queue}' was not populated")
+            sys.exit(1)
+
+        # Log the photo IDs to a file so that it is easier to recover if something
+        # fails during the process.
+        file_logger = get_file_logger(
+            args.logfile.format(album_name=album_name, worker=worker), __name__
+        )
+
+        if args.command == "work":
+            if args.requeue_failed:
+                logger.info(f"Requeued {queue.requeue_failed()} failed files")
+            upload_queued_files(queue, worker, file_logger, flickr, args)
+        else:
+            finalize(queue, worker, file_logger, flickr, args)
@@ -0,0 +1,163 @@
+"""
+
+Accounting of Flickr API calls against the per key hourly limit.
+
+The calls are counted in sliding window stored in a file under the ~/.flickr
+directory. The file is locked while being updated so that all the processes
+using the same API key on the host share the count.
+
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from decouple import config
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl the count is shared only by the threads of the process.
+    fcntl = None
+
+QUOTA_DIR = os.path.expanduser(os.path.join("~", ".flickr"))
+
+# Flickr allows 3600 calls per key per hour. Limit of 0 (or less) means
+# the calls are not limited nor counted.
+DEFAULT_LIMIT = config("FLICKR_API_QUOTA", default=3600, cast=int)
+DEFAULT_WINDOW = 3600
+
+# Number of buckets the window is divided into.
+NUM_BUCKETS = 60
+
+# Once this fraction of the limit is used up, the calls are spaced apart,
+# with the spacing growing as the limit is approached, so that the calls
+# slow down gradually rather than hit the limit at once.
+PACING_THRESHOLD = 0.5
+
+
+class ApiQuota:
+    """
+    Sliding window count of API calls persisted in a file.
+
+    The window is divided into buckets, each counting the calls made
+    in its time interval. The file also records the time of the last call
+    which is used for pacing the calls.
+    """
+
+    def __init__(self, path, limit=DEFAULT_LIMIT, window=DEFAULT_WINDOW):
+        """
+        :param path: path to the file with the counts
+        :param limit: maximum number of calls in the window, 0 means unlimited
+        :param window: length of the window in seconds
+        """
+        self.path = path
+        self.limit = limit
+        self.window = window
+        self.bucket_length = window / NUM_BUCKETS
+        self.lock = threading.Lock()
+
+    def _read(self, file_obj):
+        """
+        return the state stored in the file with the expired buckets dropped
+        """
+        file_obj.seek(0)
+        try:
+            state = json.load(file_obj)
+        except ValueError:
+            state = {}
+
+        oldest = time.time() - self.window
+        state["buckets"] = {
+            start: count
+            for start, count in state.get("buckets", {}).items()
+            if float(start) + self.bucket_length > oldest
+        }
+        state.setdefault("last", 0)
+
+        return state
+
+    def _write(self, file_obj, state):
+        file_obj.seek(0)
+        file_obj.truncate()
+        json.dump(state, file_obj)
+        file_obj.flush()
+
+    def _locked(self, func):
+        """
+        Call func with the opened file while holding the locks and return its value.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            # pylint: disable=W1514
+            with open(self.path, "a+") as file_obj:
+                if fcntl is not None:
+                    fcntl.flock(file_obj, fcntl.LOCK_EX)
+                try:
+                    return func(file_obj)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(file_obj, fcntl.LOCK_UN)
+
+    def _try_acquire(self, file_obj):
+        """
+        Record the call if allowed.
+        :return: 0 if the call was recorded, otherwise number of seconds to wait
+        """
+        state = self._read(file_obj)
+        now = time.time()
+
+        used = sum(state["buckets"].values())
+        if used >= self.limit:
+            oldest = min(float(start) for start in state["buckets"])
+            return oldest + self.bucket_length + self.window - now
+
+        if used >= self.limit * PACING_THRESHOLD:
+            fraction = (used / self.limit - PACING_THRESHOLD) / (1 - PACING_THRESHOLD)
+            next_call = state["last"] + fraction * self.window / self.limit
+            if next_call > now:
+                return next_call - now
+
+        bucket = str(int(now // self.bucket_length * self.bucket_length))
+        state["buckets"][bucket] = state["buckets"].get(bucket, 0) + 1
+        state["last"] = now
+        self._write(file_obj, state)
+
+        return 0
+
+    def acquire(self):
+        """
+        Wait until API call can be made without exceeding the limit and record it.
+        """
+        logger = logging.getLogger(__name__)
+
+        if self.limit <= 0:
+            return
+
+        while True:
+            delay = self._locked(self._try_acquire)
+            if delay <= 0:
+                return
+
+            logger.debug(f"Waiting {delay:.1f} seconds for API quota")
+            time.sleep(delay)
+
+    def remaining(self):
+        """
+        return number of calls remaining in the current window
+        or None if the calls are not limited
+        """
+        if self.limit <= 0:
+            return None
+
+        state = self._locked(self._read)
+        return max(self.limit - sum(state["buckets"].values()), 0)
+
+
+def get_quota_path(api_key):
+    """
+    return path to the file with the counts for given API key
+    """
+    return os.path.join(QUOTA_DIR, f"quota-{api_key}.json")
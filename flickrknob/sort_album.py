@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+
+This program sorts photos in given albums on the server, e.g. albums
+assembled by hand or by multiple uploads. The dates are retrieved along
+with the list of photos in the album so there is no need for the original files.
+
+"""
+
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+
+import flickrapi
+
+from .flickrknob import (
+    auth_check,
+    get_album_photos,
+    get_albums,
+    log_remaining_calls,
+    reorder_album,
+)
+from .logutil import get_package_logger
+from .parserutil import get_base_parser, get_cache_parser
+from .utils import check_env, get_album_names, parse_args, run_windowed
+
+flickrKey = config("FLICKR_KEY")
+flickrSecret = config("FLICKR_SECRET")
+
+# Map sort keys to functions returning the value to sort by from the photo
+# attributes. The date taken is in the "YYYY-MM-DD HH:MM:SS" format
+# so it can be compared as string.
+SORT_KEYS = {
+    "taken": lambda photo: photo.get("datetaken") or "",
+    "upload": lambda photo: int(photo.get("dateupload") or 0),
+    "title": lambda photo: photo.get("title") or "",
+}
+
+
+def get_args():
+    """
+    return parsed arguments from command line
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        description="sort photos in Flickr albums",
+        parents=[get_base_parser(), get_cache_parser()],
+    )
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        default=False,
+        help="sort all albums",
+    )
+    parser.add_argument(
+        "-k",
+        "--key",
+        choices=list(SORT_KEYS.keys()),
+        default="taken",
+        help="sort by date taken, date of upload or title",
+    )
+    parser.add_argument(
+        "-r",
+        "--reverse",
+        action="store_true",
+        default=False,
+        help="sort in descending order",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="only report the albums that would be sorted",
+    )
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
+    parser.add_argument("name", nargs="*", help="album name")
+
+    args = parse_args(parser)
+    if not args.all and not args.name:
+        parser.error("specify album names or --all")
+
+    return args
+
+
+def get_sorted_ids(photos, key, reverse):
+    """
+    Sort the photos by the key, with ties broken by title and photo ID.
+    :return: tuple of list of photo IDs in the current order
+    and list of photo IDs in the sorted order
+    """
+    sort_key = SORT_KEYS[key]
+    entries = [
+        (sort_key(photo), photo.get("title") or "", photo["id"]) for photo in photos
+    ]
+    current = [entry[2] for entry in entries]
+
+    # The tie breakers are always in ascending order.
+    entries.sort(key=lambda entry: entry[1:])
+    entries.sort(key=lambda entry: entry[0], reverse=reverse)
+
+    return current, [entry[2] for entry in entries]
+
+
+# pylint: disable=R0913
+def sort_album(flickr, album_name, album_id, key, reverse, dry_run):
+    """
+    worker function to sort single album
+    :return: True if the album was not sorted before
+    """
+    logger = logging.getLogger(__name__)
+
+    extras = ["date_taken", "date_upload"]
+    current, photo_ids = get_sorted_ids(
+        get_album_photos(flickr, album_id, extras=extras), key, reverse
+    )
+    if current == photo_ids:
+        logger.info(f"Album '{album_name}' is already sorted")
+        return False
+
+    if dry_run:
+        logger.info(f"Album '{album_name}' would be sorted")
+    else:
+        logger.info(f"Sorting {len(photo_ids)} photos in album '{album_name}'")
+        reorder_album(flickr, album_id, photo_ids)
+
+    return True
+
+
+def sort_albums():
+    """
+    command line tool to sort albums
+    """
+    args = get_args()
+
+    logger = get_package_logger(args.loglevel)
+
+    check_env(flickrKey, flickrSecret)
+
+    logger.info("Checking authentication")
+    flickr = flickrapi.FlickrAPI(flickrKey, flickrSecret)
+    auth_check(flickr, perms="write")
+
+    logger.info("Getting list of albums")
+    albums = get_albums(flickr, mirror_path=args.db if args.cached else None)
+    if albums is None:
+        sys.exit(1)
+    album_names = get_album_names(albums, args)
+
+    sorted_count = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        tasks = run_windowed(
+            executor,
+            sort_album,
+            (
+                (flickr, name, albums[name], args.key, args.reverse, args.dry_run)
+                for name in album_names
+            ),
+            args.threads,
+        )
+        for (_, name, _, _, _, _), future in tasks:
+            try:
+                if future.result():
+                    sorted_count = sorted_count + 1
+            except flickrapi.FlickrError as exc:
+                logger.error(f"Failed to sort album '{name}': {exc}")
+                failed = failed + 1
+
+    logger.info(
+        f"{'Would sort' if args.dry_run else 'Sorted'} {sorted_count} "
+        f"out of {len(album_names)} albums"
+    )
+
+    log_remaining_calls(flickr)
+
+    if failed > 0:
+        sys.exit(1)
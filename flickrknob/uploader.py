@@ -11,33 +11,48 @@ import argparse
 import logging
 import os
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
 from alive_progress import alive_bar
 from decouple import config
 
 from flickrapi import FlickrAPI, FlickrError
 
-from .flickrknob import auth_check, create_album, get_albums, upload_photo
+from .bandwidth import get_bucket
+from .flickrknob import (
+    add_to_album,
+    auth_check,
+    create_album,
+    get_albums,
+    log_remaining_calls,
+    reorder_album,
+    upload_photo,
+)
 from .logutil import get_file_logger, get_package_logger
-from .parserutil import get_base_parser
-from .photoutils import get_date, is_known_suffix
-from .utils import check_dir, check_env, parse_args
+from .parserutil import get_base_parser, get_rate_parser
+from .photoutils import InvalidFileError, get_date, is_known_suffix, validate_file
+from .utils import check_dir, check_env, parse_args, run_windowed
 
 flickrKey = config("FLICKR_KEY")
 flickrSecret = config("FLICKR_SECRET")
 
 
 # pylint: disable=R0913
-def upload_single_photo(file_path, progress_bar, file_logger, flickr, dedup, retries):
+def upload_single_photo(
+    file_path, progress_bar, file_logger, flickr, dedup, retries, bucket=None
+):
     """
     worker function to upload a photo and report progress
     """
 
     file_name = os.path.basename(file_path)
     photo_id = upload_photo(
-        flickr, file_path, title=file_name, dedup=dedup, retries=retries
+        flickr,
+        file_path,
+        title=file_name,
+        dedup=dedup,
+        retries=retries,
+        bucket=bucket,
     )
 
     progress_bar()
@@ -51,10 +66,7 @@ def add_photo_to_album(progress_bar, file_logger, flickr, photo_id, album_id):
     worker function to add photo to album and report progress
     """
 
-    logger = logging.getLogger(__name__)
-
-    logger.debug(f"Adding file {photo_id} to album {album_id}")
-    flickr.photosets.addPhoto(photoset_id=album_id, photo_id=photo_id)
+    add_to_album(flickr, album_id, photo_id)
     progress_bar()
     file_logger.info(f"Added {photo_id} to album {album_id}")
 
@@ -66,7 +78,7 @@ def get_args():
     parser = argparse.ArgumentParser(
         add_help=False,
         description="yet another Flickr uploader",
-        parents=[get_base_parser()],
+        parents=[get_base_parser(), get_rate_parser()],
     )
     parser.add_argument(
         "-D", "--dedup", action="store_true", default=False, help="deduplicate photos"
@@ -76,13 +88,20 @@ def get_args():
         help="Log file to record uploaded files",
         default="files-{album_name}.log",
     )
+    parser.add_argument(
+        "--rejected",
+        help="Report file to record files rejected by pre-flight checks",
+        default="rejected-{album_name}.log",
+    )
     parser.add_argument(
         "--retries",
         help="Number of retries when single file upload fails",
         type=int,
         default=3,
     )
-    parser.add_argument("--threads", help="Number of threads to create", default=4)
+    parser.add_argument(
+        "--threads", help="Number of threads to create", type=int, default=4
+    )
     parser.add_argument("photosetName")
     parser.add_argument("sourceDir")
     args = parse_args(parser)
@@ -97,7 +116,6 @@ def check_album_name(album_name, flickr):
 
     logger.info("Checking album name")
     albums = get_albums(flickr)
-    logger.debug(f"Albums: {albums}")
     if albums is None or len(albums.items()) == 0:
         logger.error("Empty list of albums. Cannot check for dups.")
         sys.exit(1)
@@ -108,35 +126,67 @@ def check_album_name(album_name, flickr):
 
 
 # pylint: disable=R0914,R0913
-def upload_files(dir_entries, file_logger, flickr, numworkers, dedup, retries):
+def upload_files(
+    dir_entries,
+    file_logger,
+    flickr,
+    numworkers,
+    dedup,
+    retries,
+    bucket=None,
+    total=None,
+    rejected=None,
+):
     """
-    upload files to Flickr
+    upload files to Flickr. If bucket is specified, all the uploads
+    draw from it. The files can be generated as they become available,
+    in which case total is the expected number of files. If some of these
+    are rejected while generating the files, they are appended to the rejected
+    list and counted as processed.
     """
     logger = logging.getLogger(__name__)
 
-    logger.info(f"Uploading {len(dir_entries)} files")
+    if total is None:
+        total = len(dir_entries)
+
+    logger.info(f"Uploading {total} files")
     photo_ids = {}
     primary_photo_id = None
-    with alive_bar(len(dir_entries)) as progress_bar:
+    with alive_bar(total) as progress_bar:
+
+        def count_rejected(file_paths):
+            # pylint: disable=E1102
+            reported = 0
+            for file_path in file_paths:
+                if rejected is not None and len(rejected) > reported:
+                    progress_bar(len(rejected) - reported)
+                    reported = len(rejected)
+                yield file_path
+            if rejected is not None and len(rejected) > reported:
+                progress_bar(len(rejected) - reported)
+
         with ThreadPoolExecutor(max_workers=numworkers) as executor:
-            futures = []
-            for i, file_path in enumerate(dir_entries):
-                # Simulate pipeline start for better bandwidth utilization.
-                # Assumes the threads will start running immediately.
-                if i < numworkers:
-                    time.sleep(i * 0.5)
-                futures.append(
-                    executor.submit(
-                        upload_single_photo,
+            # Simulate pipeline start for better bandwidth utilization.
+            # Assumes the threads will start running immediately.
+            tasks = run_windowed(
+                executor,
+                upload_single_photo,
+                (
+                    (
                         file_path,
                         progress_bar,
                         file_logger,
                         flickr,
                         dedup,
                         retries,
+                        bucket,
                     )
-                )
-            for future in as_completed(futures):
+                    for file_path in count_rejected(dir_entries)
+                ),
+                numworkers,
+                stagger=0.5,
+            )
+            for _, future in tasks:
                 try:
                     file_name, photo_id = future.result()
                     photo_ids[file_name] = photo_id
@@ -146,7 +196,8 @@ def upload_files(dir_entries, file_logger, flickr, numworkers, dedup, retries):
                     logger.error(exc)
 
     logger.info(f"Uploaded {len(photo_ids)} files")
-    logger.debug(f"File to IDs: {photo_ids}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"File to IDs: {photo_ids}")
 
     return photo_ids, primary_photo_id
 
@@ -163,25 +214,19 @@ def add_files_to_album(
     logger.info(f"Adding files to album {album_id}")
     with alive_bar(len(photo_ids.keys()) - 1) as progress_bar:
         with ThreadPoolExecutor(max_workers=numworkers) as executor:
-            futures = []
-            for photo_id in photo_ids.values():
-                # Primary photo was automatically added to the album,
-                # so skip it.
-                if photo_id == primary_photo_id:
-                    continue
-
-                futures.append(
-                    executor.submit(
-                        add_photo_to_album,
-                        progress_bar,
-                        file_logger,
-                        flickr,
-                        photo_id,
-                        album_id,
-                    )
-                )
-
-            for future in as_completed(futures):
+            # Primary photo was automatically added to the album,
+            # so skip it.
+            tasks = run_windowed(
+                executor,
+                add_photo_to_album,
+                (
+                    (progress_bar, file_logger, flickr, photo_id, album_id)
+                    for photo_id in photo_ids.values()
+                    if photo_id != primary_photo_id
+                ),
+                numworkers,
+            )
+            for _, future in tasks:
                 try:
                     future.result()
                 except FlickrError as exc:
@@ -196,11 +241,103 @@ def reorder_files(album_id, dir_entries, flickr, photo_ids):
 
     logger.info("Sorting files in the album")
     dir_file_names = list(map(os.path.basename, dir_entries))
-    photo_ids_sorted = list(map(photo_ids.get, dir_file_names))
-    logger.debug(f"Sorted photo IDs: {photo_ids_sorted}")
-    flickr.photosets.reorderPhotos(
-        photoset_id=album_id, photo_ids=",".join(photo_ids_sorted)
-    )
+    # Files that failed to upload do not have photo ID.
+    photo_ids_sorted = [
+        photo_ids[file_name] for file_name in dir_file_names if file_name in photo_ids
+    ]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Sorted photo IDs: {photo_ids_sorted}")
+    reorder_album(flickr, album_id, photo_ids_sorted)
+
+
+def get_dir_entries(dir_name):
+    """
+    Return list of files with known suffix in the top level of the directory.
+    Exits the program if there are no files to upload.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.info(f"Getting list of files from '{dir_name}'")
+    dir_entries = [
+        os.path.join(dir_name, f)
+        for f in os.listdir(dir_name)
+        if os.path.isfile(os.path.join(dir_name, f)) and is_known_suffix(f)
+    ]
+
+    if len(dir_entries) == 0:
+        logger.info("No files to upload, exiting")
+        sys.exit(0)
+
+    return dir_entries
+
+
+def preflight_file(file_path):
+    """
+    worker function to check that the file can be uploaded
+    :return: (EXIF) date of the file
+    """
+    validate_file(file_path)
+    try:
+        return get_date(file_path)
+    except OSError as exc:
+        # pylint: disable=W0707
+        raise InvalidFileError(f"cannot read file: {exc}")
+
+
+def preflight_files(dir_entries, numworkers, dates, rejected):
+    """
+    Check the files in parallel and generate those that can be uploaded,
+    as soon as they are checked.
+    The (EXIF) dates of the files are stored in the dates dictionary,
+    the rejected files are appended to the rejected list
+    as (file path, reason) tuples.
+    """
+    logger = logging.getLogger(__name__)
+
+    with ThreadPoolExecutor(max_workers=numworkers) as executor:
+        tasks = run_windowed(
+            executor,
+            preflight_file,
+            ((file_path,) for file_path in dir_entries),
+            numworkers,
+        )
+        for (file_path,), future in tasks:
+            try:
+                dates[file_path] = future.result()
+            except InvalidFileError as exc:
+                logger.warning(f"Rejecting '{file_path}': {exc}")
+                rejected.append((file_path, str(exc)))
+                continue
+
+            yield file_path
+
+
+def sort_by_date(dates):
+    """
+    return list of the files sorted according to their (EXIF) date
+    """
+    logger = logging.getLogger(__name__)
+
+    dir_entries = sorted(dates, key=lambda file_path: (dates[file_path], file_path))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Sorted files: {dir_entries}")
+
+    return dir_entries
+
+
+def write_rejection_report(report_file, rejected):
+    """
+    Write the rejected files along with the reasons to the report file.
+    """
+    logger = logging.getLogger(__name__)
+
+    if len(rejected) == 0:
+        return
+
+    logger.warning(f"Rejected {len(rejected)} files, see '{report_file}'")
+    with open(report_file, "w", encoding="utf-8") as report:
+        for file_path, reason in sorted(rejected):
+            report.write(f"{file_path}: {reason}\n")
 
 
 # pylint: disable=R0914
@@ -228,29 +365,14 @@ def uploader():
     #
     check_album_name(args.photosetName, flickr)
 
-    # List files in the top level of the directory.
-    dir_name = args.sourceDir
-    logger.info(f"Getting list of files from '{dir_name}'")
-    dir_entries = [
-        os.path.join(dir_name, f)
-        for f in os.listdir(dir_name)
-        if os.path.isfile(os.path.join(dir_name, f)) and is_known_suffix(f)
-    ]
+    dir_entries = get_dir_entries(args.sourceDir)
 
-    if len(dir_entries) == 0:
-        logger.info("No files to upload, exiting")
-        sys.exit(0)
-
-    # Sort the files according to the (EXIF) date.
-    # This serves also as prevention for file related problems in the upload
-    # phase (except this is still a TOCTOU problem).
-    logger.info(f"Sorting {len(dir_entries)} files")
-    try:
-        dir_entries.sort(key=get_date)
-    except PermissionError as exc:
-        logger.error(exc)
-        sys.exit(1)
-    logger.debug(f"Sorted files: {dir_entries}")
+    # The files are checked in parallel and uploaded as soon as they pass
+    # the checks. The (EXIF) dates gathered by the checks are used to sort
+    # the files in the album afterwards.
+    dates = {}
+    rejected = []
+    checked_files = preflight_files(dir_entries, args.threads, dates, rejected)
 
     # Log the photo IDs to a file so that it is easier to recover if something
     # fails during the process.
@@ -258,20 +380,44 @@ def uploader():
         args.logfile.format(album_name=args.photosetName), __name__
     )
 
-    photo_ids, primary_photo_id = upload_files(
-        dir_entries, file_logger, flickr, args.threads, args.dedup, args.retries
-    )
-
-    album_id = create_album(
-        flickr, title=args.photosetName, primary_photo_id=primary_photo_id
-    )
-    if album_id is None:
-        logger.error(f"Failed to create album '{args.photosetName}'")
+    # Ctrl-C stops submitting new tasks, the tasks in progress are finished.
+    try:
+        try:
+            photo_ids, primary_photo_id = upload_files(
+                checked_files,
+                file_logger,
+                flickr,
+                args.threads,
+                args.dedup,
+                args.retries,
+                get_bucket(args.max_rate, args.rate_schedule),
+                total=len(dir_entries),
+                rejected=rejected,
+            )
+        finally:
+            # Report the files rejected so far even if the upload did not finish.
+            write_rejection_report(
+                args.rejected.format(album_name=args.photosetName), rejected
+            )
+        if len(photo_ids) == 0:
+            logger.error("No files were uploaded")
+            sys.exit(1)
+
+        album_id = create_album(
+            flickr, title=args.photosetName, primary_photo_id=primary_photo_id
+        )
+        if album_id is None:
+            logger.error(f"Failed to create album '{args.photosetName}'")
+            sys.exit(1)
+
+        add_files_to_album(
+            album_id, file_logger, flickr, args.threads, photo_ids, primary_photo_id
+        )
+    except KeyboardInterrupt:
+        logger.error("Interrupted, see the log file for the files processed so far")
         sys.exit(1)
 
-    add_files_to_album(
-        album_id, file_logger, flickr, args.threads, photo_ids, primary_photo_id
-    )
-
     # The files need to be reordered since they were uploaded in parallel.
-    reorder_files(album_id, dir_entries, flickr, photo_ids)
+    reorder_files(album_id, sort_by_date(dates), flickr, photo_ids)
+
+    log_remaining_calls(flickr)
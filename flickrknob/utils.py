@@ -7,6 +7,8 @@ helper functions
 import logging
 import os
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
 
 
 def parse_args(parser):
@@ -65,3 +67,80 @@ def check_dir(name):
     if not os.path.isdir(name):
         logger.critical(f"'{name}' is not a directory")
         sys.exit(1)
+
+
+def get_album_names(albums, args):
+    """
+    return list of album names given on the command line, or all album names
+    if the --all option was given. Exits the program if some album
+    does not exist.
+    """
+    logger = logging.getLogger(__name__)
+
+    if args.all:
+        return list(albums.keys())
+
+    for album_name in args.name:
+        if album_name not in albums:
+            logger.error(f"Did not find album with name '{album_name}'")
+            sys.exit(1)
+
+    return args.name
+
+
+# pylint: disable=R0913
+def run_windowed(executor, func, items, numworkers, backlog=None, stagger=0):
+    """
+    Submit func(*item) to the executor for each item (tuple of arguments)
+    and generate (item, future) pairs as the tasks complete.
+
+    At most numworkers + backlog (numworkers by default) tasks are submitted
+    at any time, new tasks are submitted as the previous ones complete.
+    The items are consumed lazily so neither the items nor the futures
+    for the whole run are held in memory.
+
+    The first numworkers tasks are submitted with increasing delays of
+    stagger seconds in order to simulate pipeline start.
+
+    If the generator is interrupted (e.g. by KeyboardInterrupt), no more tasks
+    are submitted, the queued tasks are cancelled and the tasks in progress
+    are waited for.
+    """
+    logger = logging.getLogger(__name__)
+
+    if backlog is None:
+        backlog = numworkers
+
+    items = iter(items)
+    pending = {}
+    submitted = 0
+
+    def submit():
+        nonlocal submitted
+        for item in items:
+            if submitted < numworkers:
+                time.sleep(submitted * stagger)
+            pending[executor.submit(func, *item)] = item
+            submitted = submitted + 1
+            return
+
+    try:
+        while len(pending) < numworkers + backlog:
+            num_pending = len(pending)
+            submit()
+            if len(pending) == num_pending:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                submit()
+                yield item, future
+    finally:
+        if pending:
+            for future in pending:
+                future.cancel()
+            in_progress = [future for future in pending if not future.cancelled()]
+            logger.info(f"Waiting for {len(in_progress)} tasks in progress to finish")
+            wait(in_progress)
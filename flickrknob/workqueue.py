@@ -0,0 +1,296 @@
+"""
+
+Work queue that hands out files to upload workers.
+
+The queue is stored in SQLite database file so that it can be shared
+by multiple worker processes, possibly running on multiple hosts
+if the file resides on shared storage.
+
+Each file is leased to a worker for limited amount of time. If the worker
+does not report the result of the upload before the lease expires
+(e.g. because it crashed), the file will be handed out to another worker.
+
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueueError(Exception):
+    """
+    exception class to report problems with the work queue
+    """
+
+
+def get_worker_id():
+    """
+    return identification of this worker process that is unique across hosts
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    SQLite backed queue of files to be uploaded into single album.
+    """
+
+    def __init__(self, path, timeout=60):
+        """
+        :param path: path to the database file
+        :param timeout: how long to wait (in seconds) for the database lock
+        """
+        self.path = path
+        # The transactions are managed explicitly so that the lease operations
+        # can acquire the write lock upfront.
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "position INTEGER NOT NULL, "
+                "state TEXT NOT NULL, "
+                "worker TEXT, "
+                "lease_expires REAL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "photo_id TEXT, "
+                "error TEXT)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_state ON files (state, position)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        close the database connection
+        """
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the enclosed statements in a transaction that holds the write lock.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def get_meta(self, key):
+        """
+        return value stored for the key or None
+        """
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        return row[0]
+
+    def set_meta(self, key, value):
+        """
+        store value for the key
+        """
+        with self._transaction():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def populate(self, album_name, file_paths):
+        """
+        Fill the queue with files to be uploaded into the album.
+        The order of the files is retained and used for the album.
+        Throws WorkQueueError if the queue was already populated.
+        """
+        logger = logging.getLogger(__name__)
+
+        with self._transaction():
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'album_name'"
+            ).fetchone()
+            if row is not None:
+                raise WorkQueueError(
+                    f"queue '{self.path}' already populated for album '{row[0]}'"
+                )
+
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('album_name', ?)", (album_name,)
+            )
+            self.conn.executemany(
+                "INSERT INTO files (path, position, state) VALUES (?, ?, ?)",
+                ((path, i, PENDING) for i, path in enumerate(file_paths)),
+            )
+
+        logger.debug(f"Populated queue '{self.path}' with {len(file_paths)} files")
+
+    def lease(self, worker, count, duration, max_attempts=None):
+        """
+        Lease up to count files to the worker for given number of seconds.
+        Files with expired leases are handed out again, unless they were
+        already leased max_attempts times (e.g. because they keep crashing
+        the workers) in which case they are marked as failed.
+        :return: list of file paths
+        """
+        logger = logging.getLogger(__name__)
+
+        now = time.time()
+        with self._transaction():
+            if max_attempts is not None:
+                cursor = self.conn.execute(
+                    "UPDATE files SET state = ?, "
+                    "error = 'lease expired ' || attempts || ' times' "
+                    "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, LEASED, now, max_attempts),
+                )
+                if cursor.rowcount > 0:
+                    logger.warning(
+                        f"Gave up on {cursor.rowcount} files after {max_attempts} "
+                        "expired leases"
+                    )
+            rows = self.conn.execute(
+                "SELECT path, state, worker FROM files "
+                "WHERE state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY position LIMIT ?",
+                (PENDING, LEASED, now, count),
+            ).fetchall()
+            for path, state, previous_worker in rows:
+                if state == LEASED:
+                    logger.info(
+                        f"Lease of '{path}' by {previous_worker} expired, "
+                        f"reassigning to {worker}"
+                    )
+            self.conn.executemany(
+                "UPDATE files SET state = ?, worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE path = ?",
+                ((LEASED, worker, now + duration, path) for path, _, _ in rows),
+            )
+
+        return [path for path, _, _ in rows]
+
+    def renew(self, worker, file_paths, duration):
+        """
+        Extend the leases the worker holds on the files.
+        """
+        with self._transaction():
+            self.conn.executemany(
+                "UPDATE files SET lease_expires = ? "
+                "WHERE path = ? AND state = ? AND worker = ?",
+                ((time.time() + duration, path, LEASED, worker) for path in file_paths),
+            )
+
+    def complete(self, worker, file_path, photo_id):
+        """
+        Record the photo ID of uploaded file. The result is accepted even
+        if the lease has expired in the meantime, unless another worker
+        has completed the file already.
+        """
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE files SET state = ?, worker = ?, photo_id = ?, error = NULL "
+                "WHERE path = ? AND state != ?",
+                (DONE, worker, photo_id, file_path, DONE),
+            )
+
+    def fail(self, worker, file_path, error):
+        """
+        Record failure to upload the file.
+        """
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE files SET state = ?, error = ? "
+                "WHERE path = ? AND state = ? AND worker = ?",
+                (FAILED, str(error), file_path, LEASED, worker),
+            )
+
+    def requeue_failed(self):
+        """
+        Make failed files available for leasing again.
+        :return: number of files requeued
+        """
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE files SET state = ?, worker = NULL, lease_expires = NULL, "
+                "attempts = 0 WHERE state = ?",
+                (PENDING, FAILED),
+            )
+            return cursor.rowcount
+
+    def counts(self):
+        """
+        return dictionary mapping file state to number of files in that state
+        """
+        ret = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for state, count in self.conn.execute(
+            "SELECT state, COUNT(*) FROM files GROUP BY state"
+        ):
+            ret[state] = count
+
+        return ret
+
+    def is_finished(self):
+        """
+        return whether all files were either uploaded or failed
+        """
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def claim_finalizer(self, worker, force=False):
+        """
+        Make the worker the finalizer of the queue. Only single worker
+        can become the finalizer unless force is True.
+        :return: True if the worker is the finalizer
+        """
+        with self._transaction():
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'finalizer'"
+            ).fetchone()
+            if row is not None and row[0] != worker and not force:
+                return False
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('finalizer', ?)",
+                (worker,),
+            )
+
+        return True
+
+    def results(self):
+        """
+        return list of (file path, photo ID) tuples for uploaded files
+        in the order in which the queue was populated
+        """
+        return self.conn.execute(
+            "SELECT path, photo_id FROM files WHERE state = ? AND photo_id IS NOT NULL "
+            "ORDER BY position",
+            (DONE,),
+        ).fetchall()
+
+    def failures(self):
+        """
+        return list of (file path, error) tuples for files that failed to upload
+        """
+        return self.conn.execute(
+            "SELECT path, error FROM files WHERE state = ? ORDER BY position",
+            (FAILED,),
+        ).fetchall()